@@ -1,31 +1,96 @@
 import os
-from flask import Flask, request, abort, jsonify
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, request, abort, jsonify, json
 from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-
-from database.models import db_drop_and_create_all, setup_db, \
-    Post, Category, Comment
+from sqlalchemy.orm.exc import StaleDataError
+
+from database.models import db, db_drop_and_create_all, setup_db, \
+    database_path, rows_to_dicts, compare_and_set, MAX_REPLY_DEPTH, Post, \
+    Category, Comment, Change, ActivityRollup, RollupWatermark
+from database.registry import setup_category_registry
+from database.rollup import hour_of
+from database.write_behind import setup_comment_writer, valid_comment, \
+    QueueFull
 from auth.auth import AuthError, requires_auth
+from server.compression import setup_compression
+from server.cors import setup_cors
+from server.encoding import setup_json
+from server.events import setup_events
+from server.idempotency import setup_idempotency, idempotent
+from server.profiling import setup_profiling
+
+# upper bound on ids per GET /posts?ids= batch
+MAX_BATCH_IDS = 100
+# page size bounds for GET /changes
+DEFAULT_CHANGES_LIMIT = 100
+MAX_CHANGES_LIMIT = 1000
+# GET /changes holds back changes younger than this many seconds
+DEFAULT_CHANGES_LAG = 10
+# bounds for GET /posts/<id>/comments, rows read per request included
+DEFAULT_THREADS = 20
+MAX_THREADS = 100
+DEFAULT_REPLIES = 10
+MAX_REPLIES = 100
+MAX_THREAD_COMMENTS = 500
+# hours of activity per GET /stats request
+DEFAULT_STATS_HOURS = 24
+MAX_STATS_HOURS = 31 * 24
+
+
+def if_match_version():
+    """
+    row version a PATCH is conditional on, from an If-Match: "<version>"
+    header as sent back from a response ETag. None for unconditional
+    updates, which are still checked against the version they loaded
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    tags = request.if_match.as_set()
+    if len(tags) != 1:
+        abort(400)
+    version = tags.pop()
+    if not version.isdigit():
+        abort(400)
+    return int(version)
+
+
+def utc_timestamp(value):
+    """
+    an ISO 8601 argument as the naive UTC timestamps are stored in,
+    converted when it carries an offset
+    """
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def missing_or_conflict(model, id):
+    """status for a failed compare_and_set, checked after the fact only"""
+    query = model.query.filter_by(id=id)
+    if hasattr(model, "deleted_at"):
+        query = query.filter_by(deleted_at=None)
+    return 409 if query.count() else 404
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
-    # CORS(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    app.config.setdefault("CHANGES_LAG", DEFAULT_CHANGES_LAG)
+    setup_db(app, app.config.get("SQLALCHEMY_DATABASE_URI", database_path))
+    setup_json(app)
+    setup_compression(app)
+    category_registry = setup_category_registry(app)
+    comment_writer = setup_comment_writer(app)
+    setup_idempotency(app)
+    comment_broker = setup_events(app, db)
+    setup_cors(app)
+    profiler = setup_profiling(app)
 
     # db_drop_and_create_all()
 
-    CORS(app, resources={r"/*": {"origins": "*"}})
-
-    @app.after_request
-    def after_request(response):
-        response.headers.add('Access-Control-Allow-Headers',
-                             'Content-Type, Authorization')
-        response.headers.add('Access-Control-Allow-Methods',
-                             'GET, POST, PATCH, DELETE, OPTIONS')
-        return response
-
     @app.route('/')
     def health():
         return jsonify({'health': 'Running!'}), 200
@@ -34,8 +99,10 @@ def create_app(test_config=None):
     @requires_auth("get:categories")
     def get_categories(payload):
         try:
-            categories_query = Category.query.order_by(Category.id).all()
-            categories = [category.short() for category in categories_query]
+            short_length = len(Category.SHORT_FIELDS)
+            categories = rows_to_dicts(
+                [row[:short_length] for row in category_registry.all()],
+                Category.SHORT_FIELDS)
         except Exception as e:
             abort(422)
 
@@ -46,6 +113,7 @@ def create_app(test_config=None):
 
     @app.route('/categories', methods=['POST'])
     @requires_auth("post:categories")
+    @idempotent
     def create_category(payload):
         try:
             data = request.get_json()
@@ -53,6 +121,7 @@ def create_app(test_config=None):
             description = data['description']
             category = Category(name, description)
             category.insert()
+            category_registry.invalidate()
 
         except Exception as e:
             abort(422)
@@ -65,31 +134,60 @@ def create_app(test_config=None):
     @app.route('/categories/<int:id>', methods=['PATCH'])
     @requires_auth("patch:categories")
     def update_category(payload, id):
-        try:
-            data = request.get_json()
-            category = Category.query.filter_by(id=id).one_or_none()
+        version = if_match_version()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'description' not in data:
+            abort(422)
+        description = data['description']
 
-            if (category is None):
+        if version is None:
+            category = Category.query.filter_by(id=id).one_or_none()
+            if category is None:
                 abort(404)
-
-            description = data['description']
-            category.description = description
-            category.update()
-
+        try:
+            if version is not None:
+                category = compare_and_set(Category, id, version, {
+                    "description": description
+                })
+            else:
+                category.description = description
+                category.update()
+                category = category.long()
+            category_registry.invalidate()
+
+        except StaleDataError:
+            abort(409)
         except Exception as e:
             abort(422)
 
-        return jsonify({
+        if category is None:
+            abort(missing_or_conflict(Category, id))
+
+        response = jsonify({
             "success": True,
-            "category": category.long()
-        }), 200
+            "category": category
+        })
+        response.set_etag(str(category["version"]))
+        return response, 200
 
     @app.route('/posts')
     @requires_auth("get:posts")
     def get_posts(payload):
+        if 'ids' in request.args:
+            return get_posts_by_ids(request.args['ids'])
+
         try:
-            posts_query = Post.query.order_by(Post.id).all()
-            posts = [post.short() for post in posts_query]
+            posts_query = Post.short_query() \
+                .filter(Post.deleted_at.is_(None)).order_by(Post.id)
+            if request.args.get('since'):
+                since = datetime.fromisoformat(request.args['since'])
+                posts_query = posts_query \
+                    .filter(Post.created_timestamp >= since)
+            if request.args.get('until'):
+                until = datetime.fromisoformat(request.args['until'])
+                posts_query = posts_query \
+                    .filter(Post.created_timestamp < until)
+            posts = rows_to_dicts(posts_query.all(), Post.SHORT_FIELDS)
         except Exception as e:
             abort(422)
 
@@ -98,31 +196,147 @@ def create_app(test_config=None):
             "posts": posts
         }), 200
 
+    def get_posts_by_ids(ids):
+        """
+        fetches many posts and their comment summaries in two queries,
+        verifying auth once for the whole batch
+        """
+        try:
+            ids = [int(post_id) for post_id in ids.split(',') if post_id]
+            if not ids or len(ids) > MAX_BATCH_IDS:
+                abort(422)
+
+            posts_query = Post.long_query() \
+                .filter(Post.id.in_(ids), Post.deleted_at.is_(None)).all()
+            posts = {
+                post["id"]: post
+                for post in rows_to_dicts(posts_query, Post.LONG_FIELDS)
+            }
+            summaries = Comment.summaries(list(posts))
+            empty_summary = {
+                "comment_count": 0,
+                "last_comment_timestamp": None
+            }
+            for post_id, post in posts.items():
+                post.update(summaries.get(post_id, empty_summary))
+        except Exception as e:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "posts": [posts[post_id] for post_id in ids if post_id in posts],
+            "missing": [post_id for post_id in ids if post_id not in posts]
+        }), 200
+
     @app.route('/posts/<int:id>', methods=['GET'])
     @requires_auth("get:posts")
     def get_post_by_id(payload, id):
+        post = Post.query.get(id)
+        if post is None or post.deleted_at is not None:
+            abort(404)
         try:
-            post = Post.query.get(id)
-            comments_query = Comment.query.order_by(Comment.post_id == id)
-            comments = [comment.long() for comment in comments_query]
+            comments_query = Comment.visible_query() \
+                .filter(Comment.post_id == id, Comment.deleted_at.is_(None))
+            if db.engine.dialect.name == "postgresql":
+                # comments never predate their post, so bounding on the
+                # post's timestamp lets Postgres skip older partitions.
+                # not on SQLite, whose CURRENT_TIMESTAMP drops the
+                # fraction a bound parameter compares against
+                comments_query = comments_query.filter(
+                    Comment.created_timestamp >= post.created_timestamp)
+            comments_query = comments_query.order_by(Comment.id).all()
+            comments = Comment.visible(comments_query)
         except Exception as e:
             abort(422)
 
-        return jsonify({
+        response = jsonify({
             "success": True,
             "post": [post.long()],
             "comments": comments
         })
+        response.set_etag(str(post.version))
+        return response
+
+    @app.route('/posts/<int:id>/comments')
+    @requires_auth("get:posts")
+    def get_post_comment_threads(payload, id):
+        if not db.session.query(Post.id) \
+                .filter_by(id=id, deleted_at=None).scalar():
+            abort(404)
+        try:
+            root = request.args.get('root')
+            root = int(root) if root else None
+            after = request.args.get('after')
+            after = int(after) if after else None
+            count = int(request.args.get('threads', DEFAULT_THREADS))
+            depth = int(request.args.get('depth', MAX_REPLY_DEPTH))
+            replies = int(request.args.get('replies', DEFAULT_REPLIES))
+        except Exception as e:
+            abort(422)
+        if not (0 < count <= MAX_THREADS and 0 <= depth and
+                0 < replies <= MAX_REPLIES):
+            abort(422)
+        if root is not None:
+            root = Comment.find_path(id, root)
+            if root is None:
+                abort(404)
+
+        try:
+            threads, truncated = Comment.threads(
+                id, root=root, count=count, after=after,
+                depth=min(depth, MAX_REPLY_DEPTH), replies=replies,
+                limit=MAX_THREAD_COMMENTS)
+        except Exception as e:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "comments": threads,
+            "truncated": truncated,
+            "next_after": threads[-1]["id"]
+            if root is None and len(threads) == count else None
+        }), 200
+
+    @app.route('/posts/<int:id>/events')
+    @requires_auth("get:posts")
+    def get_post_events(payload, id):
+        if db.session.query(Post.id) \
+                .filter_by(id=id, deleted_at=None).scalar() is None:
+            abort(404)
+
+        # subscribe before reading the backlog so nothing falls in between
+        subscription = comment_broker.subscribe(id)
+        backlog = []
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        if last_event_id.isdigit():
+            comments_query = Comment.visible_query() \
+                .filter(Comment.post_id == id,
+                        Comment.id > int(last_event_id),
+                        Comment.deleted_at.is_(None)) \
+                .order_by(Comment.id).all()
+            backlog = [
+                (comment["id"], json.dumps(comment))
+                for comment in Comment.visible(comments_query)
+            ]
+
+        return Response(
+            comment_broker.stream(id, subscription, backlog),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
 
     @app.route('/categories/<int:id>', methods=['GET'])
     @requires_auth("get:posts")
     def get_posts_from_category_id(payload, id):
         try:
-            category_query = Category.query.get(id)
-            category = category_query.long()
-            posts_query = Post.query.join(Category)\
-                .filter(Post.category_id == id).all()
-            posts = [post.short() for post in posts_query]
+            category = dict(zip(Category.LONG_FIELDS,
+                                category_registry.get(id)))
+            posts_query = Post.short_query() \
+                .filter(Post.category_id == id, Post.deleted_at.is_(None)) \
+                .order_by(Post.id).all()
+            posts = rows_to_dicts(posts_query, Post.SHORT_FIELDS)
         except Exception as e:
             abort(422)
 
@@ -134,13 +348,17 @@ def create_app(test_config=None):
 
     @app.route('/posts', methods=['POST'])
     @requires_auth("post:posts")
+    @idempotent
     def create_post(payload):
         try:
             data = request.get_json()
 
             title = data['title']
             body = data['body']
-            category_id = data['category_id']
+            category_id = int(data['category_id'])
+            # rejected here rather than by the foreign key
+            if category_registry.get(category_id) is None:
+                abort(422)
 
             post = Post(title, body, category_id)
             post.insert()
@@ -153,50 +371,140 @@ def create_app(test_config=None):
             "created_post_id": post.id
         }), 200
 
+    @app.route('/posts/<int:id>', methods=['PATCH'])
+    @requires_auth("patch:posts")
+    def update_post(payload, id):
+        version = if_match_version()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            abort(422)
+        values = {
+            field: data[field] for field in ("title", "body") if field in data
+        }
+        if not values or not values.get("title", True):
+            abort(422)
+
+        if version is None:
+            post = Post.query.filter_by(id=id, deleted_at=None).one_or_none()
+            if post is None:
+                abort(404)
+        try:
+            if version is not None:
+                post = compare_and_set(Post, id, version, values)
+            else:
+                for field, value in values.items():
+                    setattr(post, field, value)
+                post.update()
+                post = post.long()
+
+        except StaleDataError:
+            abort(409)
+        except Exception as e:
+            abort(422)
+
+        if post is None:
+            abort(missing_or_conflict(Post, id))
+
+        response = jsonify({
+            "success": True,
+            "post": post
+        })
+        response.set_etag(str(post["version"]))
+        return response, 200
+
     @app.route('/posts/<int:id>', methods=['DELETE'])
     @requires_auth("delete:posts")
     def delete_post(payload, id):
-        post = Post.query.filter_by(id=id).one_or_none()
+        post = Post.query.filter_by(id=id, deleted_at=None).one_or_none()
         if post is None:
             abort(404)
         try:
-            post.delete()
+            post.soft_delete()
         except Exception as e:
             abort(422)
         return jsonify({'success': True, 'delete': id}), 200
 
     @app.route('/comments', methods=['POST'])
     @requires_auth("post:comments")
+    @idempotent
     def create_comment_on_post(payload):
         try:
             data = request.get_json()
             post_id = data['post_id']
             body = data['body']
-            comment = Comment(post_id, body)
+            parent = None
+            if data.get('parent_id') is not None:
+                parent = Comment.find_path(post_id, data['parent_id'],
+                                           max_depth=MAX_REPLY_DEPTH - 1)
+                if parent is None:
+                    abort(422)
+            write_behind = app.config["COMMENT_WRITE_BEHIND"] and \
+                not data.get('durable', False)
+            if write_behind:
+                if not valid_comment(post_id, body):
+                    abort(422)
+            elif db.session.query(Post.id) \
+                    .filter_by(id=post_id, deleted_at=None).scalar() is None:
+                # the foreign key no longer rejects a tombstoned post
+                abort(422)
+
+        except Exception as e:
+            abort(422)
+
+        if write_behind:
+            try:
+                pending_id = comment_writer.enqueue(post_id, body, parent)
+                return jsonify({
+                    "success": True,
+                    "post_id": post_id,
+                    "pending_comment_id": pending_id
+                }), 202
+            except QueueFull:
+                if not app.config["COMMENT_QUEUE_FULL_SYNC"]:
+                    abort(503)
+
+        try:
+            comment = Comment(post_id, body, parent)
             comment.insert()
 
         except Exception as e:
             abort(422)
 
+        comment_broker.publish_comment(comment.long())
+
         return jsonify({
             "success": True,
             "post_id": comment.post_id,
             "created_comment_id": comment.id
         })
 
+    @app.route('/comments/pending/<pending_id>')
+    @requires_auth("get:comments")
+    def get_pending_comment(payload, pending_id):
+        status = comment_writer.status(pending_id)
+        if status is None:
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "pending_comment_id": pending_id,
+            **status
+        }), 200
+
     @app.route('/comments', methods=['DELETE'])
     @requires_auth("delete:comments")
     def delete_comment_on_post(payload):
         try:
             data = request.get_json()
             comment_id = data['comment_id']
-            comment = Comment.query.filter_by(id=comment_id).one_or_none()
+            comment = Comment.query \
+                .filter_by(id=comment_id, deleted_at=None).one_or_none()
             id = comment.id
 
             if comment is None:
                 abort(404)
             try:
-                comment.delete()
+                comment.soft_delete()
             except Exception as e:
                 abort(422)
             return jsonify({'success': True, 'delete': id}), 200
@@ -209,13 +517,118 @@ def create_app(test_config=None):
             "deleted": id
         })
 
+    @app.route('/changes')
+    @requires_auth("get:posts")
+    def get_changes(payload):
+        try:
+            since = int(request.args.get('since', 0))
+            limit = min(int(request.args.get('limit', DEFAULT_CHANGES_LIMIT)),
+                        MAX_CHANGES_LIMIT)
+        except Exception as e:
+            abort(422)
+        if limit < 1:
+            abort(422)
+
+        try:
+            changes = rows_to_dicts(
+                Change.since(since, limit, app.config["CHANGES_LAG"]),
+                Change.FIELDS)
+        except Exception as e:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "changes": changes,
+            "next_since": changes[-1]["seq"] if changes else since
+        }), 200
+
+    @app.route('/stats')
+    @requires_auth("get:stats")
+    def get_stats(payload):
+        try:
+            watermark = RollupWatermark.query \
+                .filter_by(name=ActivityRollup.__tablename__).one_or_none()
+            as_of = watermark.as_of if watermark else None
+            until = request.args.get('until')
+            until = utc_timestamp(until) if until else None
+            since = request.args.get('since')
+            if since:
+                since = utc_timestamp(since)
+            else:
+                since = (until or as_of or datetime.utcnow()) - \
+                    timedelta(hours=DEFAULT_STATS_HOURS)
+            category_id = request.args.get('category_id')
+            category_id = int(category_id) if category_id else None
+        except Exception as e:
+            abort(422)
+        # open-ended ranges end at the last rolled up change
+        end = until or max(since, as_of or since)
+        if end < since or end - since > timedelta(hours=MAX_STATS_HOURS):
+            abort(422)
+
+        try:
+            stats = rows_to_dicts(
+                ActivityRollup.between(hour_of(since), until,
+                                       category_id).all(),
+                ActivityRollup.FIELDS)
+        except Exception as e:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "stats": stats,
+            "totals": {
+                "posts": sum(row["posts"] for row in stats),
+                "comments": sum(row["comments"] for row in stats)
+            },
+            "as_of": as_of
+        }), 200
+
+    @app.route('/admin/profiling')
+    @requires_auth("admin:profiling")
+    def get_profiling(payload):
+        stacks = profiler.collapsed(request.args.get('route'))
+        if request.args.get('format') == 'collapsed':
+            lines = [line for route in stacks.values() for line in route]
+            return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+        return jsonify({
+            "success": True,
+            "profiling": profiler.status(),
+            "stacks": stacks
+        }), 200
+
+    @app.route('/admin/profiling', methods=['PATCH'])
+    @requires_auth("admin:profiling")
+    def update_profiling(payload):
+        try:
+            data = request.get_json()
+            profiler.configure(data.get('mode'),
+                               float(data.get('rate', 0.01)),
+                               float(data.get('interval', 0.005)))
+        except Exception as e:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "profiling": profiler.status()
+        }), 200
+
+    @app.route('/admin/profiling', methods=['DELETE'])
+    @requires_auth("admin:profiling")
+    def reset_profiling(payload):
+        profiler.reset()
+        return jsonify({"success": True}), 200
+
     @app.errorhandler(400)
     @app.errorhandler(401)
     @app.errorhandler(403)
     @app.errorhandler(404)
     @app.errorhandler(405)
+    @app.errorhandler(409)
     @app.errorhandler(422)
     @app.errorhandler(500)
+    @app.errorhandler(503)
     def error_handler(error):
         return jsonify({
             'success': False,
@@ -235,7 +648,5 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
-
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
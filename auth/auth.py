@@ -1,14 +1,33 @@
 import json
 import os
+import threading
+import time
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
-from jose import jwt
+from jose import jwt, jwk
+from jose.utils import base64url_decode
 from urllib.request import urlopen
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
-ALGORITHMS = os.environ.get('ALGORITHMS')
 API_AUDIENCE = os.environ.get('API_AUDIENCE')
 
+
+def parse_algorithms(value):
+    """parses ALGORITHMS, e.g. "['RS256']" or "RS256,RS384", into a list"""
+    if not value:
+        return ['RS256']
+    algorithms = [algorithm.strip(" '\"")
+                  for algorithm in value.strip('[]').split(',')]
+    return [algorithm for algorithm in algorithms if algorithm]
+
+
+# parsed once at import instead of on every verification
+ALGORITHMS = parse_algorithms(os.environ.get('ALGORITHMS'))
+ISSUER = 'https://{}/'.format(AUTH0_DOMAIN)
+JWKS_URL = 'https://{}/.well-known/jwks.json'.format(AUTH0_DOMAIN)
+# least seconds between two JWKS downloads triggered by an unknown kid
+JWKS_REFRESH_INTERVAL = 60
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -94,6 +113,45 @@ def check_permissions(permission, payload):
     # raise Exception('Not Implemented')
 
 
+'''
+Public keys
+
+the JWKS is downloaded once and every key in it is parsed into a public
+key object once, kept per kid. An unknown kid (e.g. after a key rotation)
+triggers a new download, at most every JWKS_REFRESH_INTERVAL seconds.
+'''
+
+_public_keys = {}
+_jwks_fetched_at = None
+_jwks_lock = threading.Lock()
+
+
+def load_jwks(jwks):
+    """parses a JWKS document into the public key cache"""
+    global _public_keys
+    _public_keys = {
+        key['kid']: jwk.construct(key, key.get('alg', ALGORITHMS[0]))
+        for key in jwks['keys']
+        if key.get('kty') == 'RSA'
+    }
+
+
+def get_public_key(kid):
+    global _jwks_fetched_at
+    public_key = _public_keys.get(kid)
+    if public_key is not None:
+        return public_key
+
+    with _jwks_lock:
+        now = time.monotonic()
+        if kid not in _public_keys and (
+                _jwks_fetched_at is None or
+                now - _jwks_fetched_at > JWKS_REFRESH_INTERVAL):
+            _jwks_fetched_at = now
+            load_jwks(json.loads(urlopen(JWKS_URL).read()))
+    return _public_keys.get(kid)
+
+
 '''
 @TODO implement verify_decode_jwt(token) method
     @INPUTS
@@ -111,34 +169,32 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    # jsonurl = urlopen(f'https://' + AUTH0_DOMAIN + '/.well-known/jwks.json')
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    public_key = get_public_key(unverified_header['kid'])
+    if public_key is not None:
         try:
+            if unverified_header.get('alg') not in ALGORITHMS:
+                raise jwt.JWTError('The specified alg value is not allowed')
+            signing_input, signature = token.encode().rsplit(b'.', 1)
+            if not public_key.verify(signing_input,
+                                     base64url_decode(signature)):
+                raise jwt.JWTError('Signature verification failed.')
+
+            # the signature is already checked with the cached key,
+            # jose only has to validate the claims
             payload = jwt.decode(
                 token,
-                rsa_key,
+                None,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer=ISSUER,
+                options={'verify_signature': False}
             )
 
             return payload
@@ -0,0 +1,81 @@
+"""
+Measures the per-request CORS overhead of flask_cors plus an
+after_request hook (the previous setup) against CORSMiddleware, for
+preflight and plain GET requests.
+
+Run from the repository root:
+    python -m benchmarks.bench_cors
+"""
+import timeit
+from flask import Flask, jsonify
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from server.cors import setup_cors
+
+try:
+    from flask_cors import CORS
+except ImportError:  # pragma: no cover - flask_cors is no longer required
+    CORS = None
+
+ROUNDS = 5000
+
+PREFLIGHT = EnvironBuilder('/posts', method='OPTIONS', headers={
+    'Origin': 'https://example.com',
+    'Access-Control-Request-Method': 'POST',
+    'Access-Control-Request-Headers': 'Authorization'
+}).get_environ()
+GET = EnvironBuilder('/posts', headers={
+    'Origin': 'https://example.com'
+}).get_environ()
+
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/posts', methods=['GET', 'POST'])
+    def posts():
+        return jsonify({"success": True})
+
+    return app
+
+
+def previous_app():
+    app = make_app()
+    CORS(app, resources={r"/*": {"origins": "*"}})
+
+    @app.after_request
+    def after_request(response):
+        response.headers.add('Access-Control-Allow-Headers',
+                             'Content-Type, Authorization')
+        response.headers.add('Access-Control-Allow-Methods',
+                             'GET, POST, PATCH, DELETE, OPTIONS')
+        return response
+
+    return app
+
+
+def current_app():
+    app = make_app()
+    setup_cors(app)
+    return app
+
+
+def per_request(app, environ):
+    def request():
+        app_iter, status, headers = run_wsgi_app(app, dict(environ))
+        b''.join(app_iter)
+    return timeit.timeit(request, number=ROUNDS) / ROUNDS * 1e6
+
+
+def main():
+    apps = [('middleware', current_app())]
+    if CORS is not None:
+        apps.insert(0, ('flask_cors', previous_app()))
+
+    for name, app in apps:
+        print("{:10} preflight: {:7.1f} us  get: {:7.1f} us".format(
+            name, per_request(app, PREFLIGHT), per_request(app, GET)))
+
+
+if __name__ == "__main__":
+    main()
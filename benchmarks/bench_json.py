@@ -0,0 +1,62 @@
+"""
+Compares the standard library JSON encoder against the orjson-backed
+encoder on get_posts-shaped payloads.
+
+Run from the repository root:
+    python -m benchmarks.bench_json
+"""
+import timeit
+from datetime import datetime
+from flask import Flask, json
+from flask.json import JSONEncoder
+
+from server.encoding import FastJSONEncoder, FastISOJSONEncoder, orjson
+
+POSTS = 2000
+REPEAT = 20
+
+
+def payload():
+    return {
+        "success": True,
+        "posts": [{
+            "id": i,
+            "title": "Post {}".format(i),
+            "created_timestamp": datetime(2021, 3, 11, 21, 56, i % 60)
+        } for i in range(POSTS)]
+    }
+
+
+def bench(app, encoder, data):
+    app.json_encoder = encoder
+    with app.app_context():
+        return min(timeit.repeat(lambda: json.dumps(data),
+                                 number=1, repeat=REPEAT))
+
+
+def main():
+    if orjson is None:
+        print("orjson is not installed, nothing to compare")
+        return
+
+    app = Flask(__name__)
+    data = payload()
+    with app.app_context():
+        app.json_encoder = JSONEncoder
+        expected = json.loads(json.dumps(data))
+        app.json_encoder = FastJSONEncoder
+        assert json.loads(json.dumps(data)) == expected
+
+    stdlib = bench(app, JSONEncoder, data)
+    fast = bench(app, FastJSONEncoder, data)
+    iso = bench(app, FastISOJSONEncoder, data)
+
+    print("{} posts".format(POSTS))
+    print("stdlib: {:8.2f} ms".format(stdlib * 1000))
+    print("orjson: {:8.2f} ms ({:.2f}x)".format(fast * 1000, stdlib / fast))
+    print("orjson, ISO datetimes: {:8.2f} ms ({:.2f}x)".format(
+        iso * 1000, stdlib / iso))
+
+
+if __name__ == "__main__":
+    main()
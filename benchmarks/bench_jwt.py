@@ -0,0 +1,75 @@
+"""
+Compares JWT verification parsing the JWK on every call (the previous
+verify_decode_jwt) against the cached public key fast path, with a
+locally generated RSA key instead of Auth0.
+
+Run from the repository root:
+    python -m benchmarks.bench_jwt
+"""
+import os
+import time
+import timeit
+
+os.environ.setdefault('AUTH0_DOMAIN', 'bench.example.com')
+os.environ.setdefault('API_AUDIENCE', 'forum')
+
+import rsa  # noqa: E402
+from jose import jwt  # noqa: E402
+from jose.utils import long_to_base64  # noqa: E402
+
+from auth import auth  # noqa: E402
+
+ROUNDS = 2000
+
+
+def make_keys():
+    public_key, private_key = rsa.newkeys(2048)
+    jwks = {'keys': [{
+        'kty': 'RSA',
+        'kid': 'bench',
+        'use': 'sig',
+        'n': long_to_base64(public_key.n).decode(),
+        'e': long_to_base64(public_key.e).decode()
+    }]}
+    return jwks, private_key.save_pkcs1().decode()
+
+
+def make_token(private_pem):
+    now = int(time.time())
+    return jwt.encode({
+        'iss': auth.ISSUER,
+        'aud': auth.API_AUDIENCE,
+        'sub': 'bench|1',
+        'iat': now,
+        'exp': now + 3600,
+        'permissions': ['get:posts']
+    }, private_pem, algorithm='RS256', headers={'kid': 'bench'})
+
+
+def jwk_per_call(token, jwks):
+    header = jwt.get_unverified_header(token)
+    rsa_key = next(key for key in jwks['keys']
+                   if key['kid'] == header['kid'])
+    return jwt.decode(token, rsa_key, algorithms=auth.ALGORITHMS,
+                      audience=auth.API_AUDIENCE, issuer=auth.ISSUER)
+
+
+def main():
+    jwks, private_pem = make_keys()
+    token = make_token(private_pem)
+    auth.load_jwks(jwks)
+    assert jwk_per_call(token, jwks) == auth.verify_decode_jwt(token)
+
+    before = timeit.timeit(lambda: jwk_per_call(token, jwks), number=ROUNDS)
+    after = timeit.timeit(lambda: auth.verify_decode_jwt(token),
+                          number=ROUNDS)
+
+    print("jwk parsed per call: {:8.0f} verifications/s".format(
+        ROUNDS / before))
+    print("cached public key:   {:8.0f} verifications/s".format(
+        ROUNDS / after))
+    print("speedup:             {:8.2f}x".format(before / after))
+
+
+if __name__ == "__main__":
+    main()
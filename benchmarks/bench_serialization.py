@@ -0,0 +1,55 @@
+"""
+Compares listing serialization through full ORM instances against the
+column-only short_query() path.
+
+Run from the repository root:
+    python -m benchmarks.bench_serialization
+"""
+import timeit
+from flask import Flask
+
+from database.models import db, setup_db, rows_to_dicts, Category, Post
+
+ROWS = 2000
+REPEAT = 20
+
+
+def seed():
+    category = Category("Benchmarks", "Seed data for benchmarks")
+    category.insert()
+    db.session.add_all([
+        Post("Post {}".format(i), "x" * 1000, category.id)
+        for i in range(ROWS)
+    ])
+    db.session.commit()
+
+
+def orm_listing():
+    db.session.expunge_all()
+    return [post.short() for post in Post.query.order_by(Post.id).all()]
+
+
+def column_listing():
+    db.session.expunge_all()
+    rows = Post.short_query().order_by(Post.id).all()
+    return rows_to_dicts(rows, Post.SHORT_FIELDS)
+
+
+def main():
+    app = Flask(__name__)
+    setup_db(app, "sqlite://")
+    with app.app_context():
+        db.create_all()
+        seed()
+        assert orm_listing() == column_listing()
+        orm = min(timeit.repeat(orm_listing, number=1, repeat=REPEAT))
+        column = min(timeit.repeat(column_listing, number=1, repeat=REPEAT))
+
+    print("{} posts".format(ROWS))
+    print("orm instances: {:8.2f} ms".format(orm * 1000))
+    print("column rows:   {:8.2f} ms".format(column * 1000))
+    print("speedup:       {:8.2f}x".format(orm / column))
+
+
+if __name__ == "__main__":
+    main()
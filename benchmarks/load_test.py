@@ -0,0 +1,81 @@
+"""
+Local load test checking that throughput scales with the number of
+gunicorn workers, using the production profile in gunicorn.conf.py.
+It hits the health endpoint, so it measures the serving stack rather
+than the database.
+
+Run from the repository root:
+    DATABASE_URL=sqlite:////tmp/forum.db python -m benchmarks.load_test
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+
+PORT = 8099
+DURATION = 5
+CLIENTS = 32
+
+
+def client(deadline):
+    connection = HTTPConnection('127.0.0.1', PORT)
+    count = 0
+    while time.monotonic() < deadline:
+        try:
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            count += 1
+        except OSError:
+            # the worker closed the keepalive connection, open another
+            connection.close()
+            connection = HTTPConnection('127.0.0.1', PORT)
+    connection.close()
+    return count
+
+
+def wait_until_up():
+    for _ in range(100):
+        try:
+            connection = HTTPConnection('127.0.0.1', PORT)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start')
+
+
+def measure(workers):
+    env = dict(os.environ, PORT=str(PORT), WEB_CONCURRENCY=str(workers),
+               GUNICORN_MAX_REQUESTS='0')
+    server = subprocess.Popen(
+        [shutil.which('gunicorn'), '-c', 'gunicorn.conf.py',
+         '--access-logfile', '/dev/null', 'app:create_app()'],
+        env=env, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up()
+        deadline = time.monotonic() + DURATION
+        with ThreadPoolExecutor(CLIENTS) as pool:
+            total = sum(pool.map(client, [deadline] * CLIENTS))
+        return total / DURATION
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    cpus = multiprocessing.cpu_count()
+    counts = sorted({1, max(cpus // 2, 1), cpus})
+    baseline = None
+    for workers in counts:
+        throughput = measure(workers)
+        baseline = baseline or throughput
+        print("{:3} workers: {:8.0f} req/s ({:.2f}x)".format(
+            workers, throughput, throughput / baseline))
+
+
+if __name__ == "__main__":
+    main()
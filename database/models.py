@@ -1,7 +1,8 @@
 import os
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey
+from datetime import timedelta
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, \
+    ForeignKey, LargeBinary, Index, func, literal, select
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
 import json
 
 # database_name = "forum"
@@ -13,16 +14,30 @@ if not database_path:
 
 # database_path = "postgres://{}/{}".format('localhost:5432', database_name)
 
+# comment paths are fixed-width ids joined by dots, so ordering on the
+# path lists a thread depth-first and every subtree is one path range
+PATH_ID_WIDTH = 10
+PATH_SEPARATOR = "."
+# sorts right after PATH_SEPARATOR, path + PATH_END bounds a subtree
+PATH_END = "/"
+# top-level comments are at depth 0
+MAX_REPLY_DEPTH = 8
+
+# tables cached in-process, their writes bump a registry version
+REGISTRY_TABLES = ("categories",)
+
 db = SQLAlchemy()
 
 
 def setup_db(app, database_path=database_path):
-    """binds a flask application and a SQLAlchemy service"""
+    """
+    binds a flask application and a SQLAlchemy service, the schema
+    itself is created by the migrations (python manage.py db upgrade)
+    """
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 
 def db_drop_and_create_all():
@@ -34,12 +49,128 @@ def db_drop_and_create_all():
     db.create_all()
 
 
-class Category(db.Model):
+def rows_to_dicts(rows, fields):
+    """
+    serializes plain column rows (as returned by the *_query() helpers)
+    into dicts keyed by fields, without building ORM instances
+    """
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def database_now():
+    """the database clock, in the wall time naive timestamps are stored in"""
+    return db.session.query(func.now()).scalar().replace(tzinfo=None)
+
+
+def record_change(record, operation, category_id=None):
+    """
+    appends a create/update/delete of record to the change log, in the
+    same transaction as the change itself. creates of posts and comments
+    carry their category_id, which the rollups count them under
+    """
+    db.session.add(Change(
+        resource=record.__tablename__,
+        record_id=record.id,
+        operation=operation,
+        category_id=category_id))
+
+
+def compare_and_set(model, id, version, values):
+    """
+    optimistic update in a single UPDATE ... WHERE id AND version
+    statement, without loading the row first. bumps the version and
+    returns the updated row as a long() dict, or None when the row is
+    gone or another writer changed it since version was read
+    """
+    table = model.__table__
+    statement = table.update() \
+        .where(table.c.id == id).where(table.c.version == version) \
+        .values(version=table.c.version + 1, **values)
+    if "deleted_at" in table.c:
+        statement = statement.where(table.c.deleted_at.is_(None))
+    columns = [table.c[field] for field in model.LONG_FIELDS]
+
+    if db.engine.dialect.name == "postgresql":
+        row = db.session.execute(statement.returning(*columns)).first()
+    elif db.session.execute(statement).rowcount == 1:
+        # no UPDATE ... RETURNING, read the row back in the same transaction
+        row = db.session.execute(
+            select(columns).where(table.c.id == id)).first()
+    else:
+        row = None
+
+    if row is None:
+        db.session.rollback()
+        return None
+    db.session.add(Change(
+        resource=table.name, record_id=id, operation="update"))
+    if table.name in REGISTRY_TABLES:
+        bump_registry_version(table.name)
+    db.session.commit()
+    return dict(zip(model.LONG_FIELDS, row))
+
+
+def bump_registry_version(name):
+    """
+    invalidates every worker's snapshot of a registry table, in the same
+    transaction as the write to it
+    """
+    bumped = RegistryVersion.query.filter_by(name=name).update(
+        {RegistryVersion.version: RegistryVersion.version + 1},
+        synchronize_session=False)
+    if not bumped:
+        db.session.add(RegistryVersion(name=name, version=1))
+
+
+def registry_version(name):
+    """current version of a registry table, 0 before its first write"""
+    return db.session.query(RegistryVersion.version) \
+        .filter_by(name=name).scalar() or 0
+
+
+def columns_query(model, fields):
+    """column-only query of fields of model, yields plain row tuples"""
+    return db.session.query(*[getattr(model, field) for field in fields])
+
+
+class FieldQueries:
+    """column-only queries matching short() and long()"""
+
+    @classmethod
+    def short_query(cls):
+        return columns_query(cls, cls.SHORT_FIELDS)
+
+    @classmethod
+    def long_query(cls):
+        return columns_query(cls, cls.LONG_FIELDS)
+
+
+def make_path(parent_path, id):
+    """materialized path of a comment, its ancestors' ids and its own"""
+    segment = "{:0{}d}".format(id, PATH_ID_WIDTH)
+    if parent_path is None:
+        return segment
+    return parent_path + PATH_SEPARATOR + segment
+
+
+def path_length(depth):
+    """length of the path of a comment depth levels below the top"""
+    return (PATH_ID_WIDTH + 1) * (depth + 1) - 1
+
+
+class Category(FieldQueries, db.Model):
     __tablename__ = "categories"
 
+    SHORT_FIELDS = ("id", "name")
+    LONG_FIELDS = ("id", "name", "description", "version")
+
     id = Column(Integer, primary_key=True)
     name = Column(String(20), unique=True, nullable=False)
     description = Column(String(100))
+    # bumped by every UPDATE, which only applies to the version it read
+    version = Column(Integer, server_default="1", nullable=False)
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(self, name, description):
         self.name = name
@@ -47,13 +178,20 @@ class Category(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        record_change(self, "create")
+        bump_registry_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
+        record_change(self, "delete")
+        bump_registry_version(self.__tablename__)
         db.session.delete(self)
         db.session.commit()
 
     def update(self):
+        record_change(self, "update")
+        bump_registry_version(self.__tablename__)
         db.session.commit()
 
     def short(self):
@@ -66,37 +204,79 @@ class Category(db.Model):
         return {
             "id": self.id,
             "name": self.name,
-            "description": self.description
+            "description": self.description,
+            "version": self.version
         }
 
     def __repr__(self):
         return "<Category {} {}>".format(self.name, self.description)
 
 
-class Post(db.Model):
+class Post(FieldQueries, db.Model):
     __tablename__ = "posts"
 
+    SHORT_FIELDS = ("id", "title", "created_timestamp")
+    LONG_FIELDS = ("id", "title", "body", "created_timestamp", "category_id",
+                   "version")
+
     id = Column(Integer, primary_key=True)
     title = Column(String(100), nullable=False)
     body = Column(String(1000))
-    created_timestamp = Column(DateTime, default=datetime.now())
+    created_timestamp = Column(DateTime, server_default=func.now(),
+                               nullable=False, index=True)
     category_id = Column(Integer, ForeignKey(Category.id), nullable=False)
+    deleted_at = Column(DateTime)
+    version = Column(Integer, server_default="1", nullable=False)
+
+    # fetch the server-side created_timestamp with the INSERT (RETURNING)
+    __mapper_args__ = {"eager_defaults": True, "version_id_col": version}
+
+    # live reads go through partial indexes that skip tombstones, the
+    # purge worker finds tombstones through the inverse one
+    __table_args__ = (
+        Index("ix_posts_live_category_id", category_id, id,
+              postgresql_where=deleted_at.is_(None)),
+        Index("ix_posts_deleted_at", deleted_at,
+              postgresql_where=deleted_at.isnot(None)),
+    )
 
     def __init__(self, title, body, category_id):
         self.title = title
         self.body = body
         self.category_id = category_id
-        self.created_timestamp = datetime.now()
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        record_change(self, "create", self.category_id)
         db.session.commit()
 
     def delete(self):
+        # comments go with their post through the cascade
+        for comment in self.posts:
+            record_change(comment, "delete")
+        record_change(self, "delete")
         db.session.delete(self)
         db.session.commit()
 
     def update(self):
+        record_change(self, "update")
+        db.session.commit()
+
+    def soft_delete(self):
+        """
+        tombstones the post, its comments become unreachable with it
+        and are removed together by the purge worker. the deletes of its
+        live comments are logged here, the purge worker logs nothing
+        """
+        live_comments = db.session.query(
+            literal(Comment.__tablename__), Comment.id, literal("delete")
+        ).filter(Comment.post_id == self.id, Comment.deleted_at.is_(None)) \
+            .order_by(Comment.id)
+        db.session.execute(Change.__table__.insert().from_select(
+            ("resource", "record_id", "operation"), live_comments))
+        self.deleted_at = func.now()
+        record_change(self, "delete")
         db.session.commit()
 
     def short(self):
@@ -112,7 +292,8 @@ class Post(db.Model):
             "title": self.title,
             "body": self.body,
             "created_timestamp": self.created_timestamp,
-            "category_id": self.category_id
+            "category_id": self.category_id,
+            "version": self.version
         }
 
     def __repr__(self):
@@ -121,34 +302,191 @@ class Post(db.Model):
             self.created_timestamp, self.category_id)
 
 
-class Comment(db.Model):
+class Comment(FieldQueries, db.Model):
     __tablename__ = "comments"
 
+    SHORT_FIELDS = ("id", "body", "created_timestamp")
+    LONG_FIELDS = ("id", "post_id", "parent_id", "body", "created_timestamp")
+    THREAD_FIELDS = ("id", "parent_id", "body", "created_timestamp", "path")
+
+    __mapper_args__ = {"eager_defaults": True}
+
     id = Column(Integer, primary_key=True)
     body = Column(String(1000), nullable=False)
-    created_timestamp = Column(DateTime, default=datetime.now())
-    post_id = Column(Integer, ForeignKey(Post.id), nullable=False)
+    created_timestamp = Column(DateTime, server_default=func.now(),
+                               nullable=False, index=True)
+    post_id = Column(Integer, ForeignKey(Post.id), nullable=False,
+                     index=True)
+    deleted_at = Column(DateTime)
+    # no foreign key: a partitioned comments table is keyed on
+    # (id, created_timestamp), so replies check their parent on insert.
+    # the path is compared bytewise, whatever the database collation
+    parent_id = Column(Integer)
+    path = Column(String(255, collation="C")
+                  .with_variant(String(255), "sqlite"))
+
+    __table_args__ = (
+        Index("ix_comments_live_post_id", post_id, id,
+              postgresql_where=deleted_at.is_(None)),
+        Index("ix_comments_live_post_path", post_id, path,
+              postgresql_where=deleted_at.is_(None)),
+        Index("ix_comments_deleted_at", deleted_at,
+              postgresql_where=deleted_at.isnot(None)),
+    )
 
     post = db.relationship(
         Post, backref=db.backref
         ("posts", cascade="save-update, merge, delete"))
 
-    def __init__(self, post_id, body):
+    def __init__(self, post_id, body, parent=None):
+        """parent is a find_path() row when the comment is a reply"""
         self.post_id = post_id
         self.body = body
-        self.created_timestamp = datetime.now()
+        self.parent_path = None
+        if parent is not None:
+            self.parent_id = parent.id
+            self.parent_path = parent.path
+
+    def assign_path(self):
+        """sets the path once the INSERT has assigned the id"""
+        self.path = make_path(self.parent_path, self.id)
+
+    def post_category(self):
+        """the category_id of the post, as a subquery of the INSERT"""
+        return select([Post.category_id]) \
+            .where(Post.id == self.post_id).as_scalar()
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        self.assign_path()
+        record_change(self, "create", self.post_category())
         db.session.commit()
 
     def delete(self):
+        record_change(self, "delete")
         db.session.delete(self)
         db.session.commit()
 
     def update(self):
+        record_change(self, "update")
         db.session.commit()
 
+    def soft_delete(self):
+        """tombstones the comment, the purge worker removes it later"""
+        self.deleted_at = func.now()
+        record_change(self, "delete")
+        db.session.commit()
+
+    @classmethod
+    def find_path(cls, post_id, id, max_depth=MAX_REPLY_DEPTH):
+        """
+        id and path of the live comment id on post_id, or None when
+        there is none or it is deeper than max_depth
+        """
+        return db.session.query(cls.id, cls.path).filter(
+            cls.id == id, cls.post_id == post_id,
+            cls.deleted_at.is_(None),
+            func.length(cls.path) <= path_length(max_depth)).first()
+
+    @classmethod
+    def visible_query(cls):
+        """long_query() with the path, for visible()"""
+        return columns_query(cls, cls.LONG_FIELDS + ("path",))
+
+    @classmethod
+    def visible(cls, rows):
+        """
+        serializes live visible_query() rows as long() dicts, dropping
+        the replies below a deleted comment as threads() does. ancestors
+        outside rows are looked up in a single query
+        """
+        comments = rows_to_dicts(rows, cls.LONG_FIELDS + ("path",))
+        ancestors = {}
+        for comment in comments:
+            path = comment.pop("path") or ""
+            ancestors[comment["id"]] = {
+                int(segment) for segment in path.split(PATH_SEPARATOR)[:-1]}
+        live = set(ancestors)
+        outside = set().union(*ancestors.values()) - live
+        if outside:
+            live.update(id for id, in db.session.query(cls.id).filter(
+                cls.id.in_(outside), cls.deleted_at.is_(None)))
+        return [comment for comment in comments
+                if ancestors[comment["id"]] <= live]
+
+    @classmethod
+    def threads(cls, post_id, root=None, count=20, after=None,
+                depth=MAX_REPLY_DEPTH, replies=10, limit=500):
+        """
+        nested reply trees of a post, read in one range scan of the
+        (post_id, path) index: the subtree of root (a find_path() row)
+        or the first count top-level threads after the top-level comment
+        after. depth bounds the levels of replies, replies the replies
+        kept per comment, limit the rows read. returns the threads and
+        whether limit cut them short
+        """
+        if root is not None:
+            lower, upper = root.path, root.path + PATH_END
+            top_length = len(root.path)
+        else:
+            lower = make_path(None, after) + PATH_END if after else ""
+            last_top = db.session.query(cls.path).filter(
+                cls.post_id == post_id, cls.deleted_at.is_(None),
+                cls.path >= lower, cls.parent_id.is_(None)
+            ).order_by(cls.path).offset(count - 1).limit(1).as_scalar()
+            # fewer than count threads left, read to the end of the post
+            upper = func.coalesce(last_top + PATH_END, "~")
+            top_length = path_length(0)
+
+        max_length = top_length + (PATH_ID_WIDTH + 1) * depth
+        rows = columns_query(cls, cls.THREAD_FIELDS).filter(
+            cls.post_id == post_id, cls.deleted_at.is_(None),
+            cls.path >= lower, cls.path < upper,
+            func.length(cls.path) <= max_length
+        ).order_by(cls.path).limit(limit).all()
+
+        # rows come parent first, so every reply finds its parent unless
+        # it was dropped: deleted, or beyond the fan-out limit
+        threads, comments = [], {}
+        for row in rows:
+            comment = dict(zip(cls.THREAD_FIELDS, row))
+            path = comment.pop("path")
+            comment["replies"] = []
+            comment["more_replies"] = 0
+            if len(path) == top_length:
+                threads.append(comment)
+            else:
+                parent = comments.get(comment["parent_id"])
+                if parent is None:
+                    continue
+                if len(parent["replies"]) >= replies:
+                    parent["more_replies"] += 1
+                    continue
+                parent["replies"].append(comment)
+            comments[comment["id"]] = comment
+
+        return threads, len(rows) == limit
+
+    @classmethod
+    def summaries(cls, post_ids):
+        """
+        comment count and latest comment timestamp per post,
+        for many posts in a single grouped query
+        """
+        rows = db.session.query(
+            cls.post_id, func.count(cls.id), func.max(cls.created_timestamp)
+        ).filter(cls.post_id.in_(post_ids), cls.deleted_at.is_(None)) \
+            .group_by(cls.post_id)
+
+        return {
+            post_id: {
+                "comment_count": count,
+                "last_comment_timestamp": last_comment
+            }
+            for post_id, count, last_comment in rows
+        }
+
     def short(self):
         return {
             "id": self.id,
@@ -160,6 +498,7 @@ class Comment(db.Model):
         return {
             "id": self.id,
             "post_id": self.post_id,
+            "parent_id": self.parent_id,
             "body": self.body,
             "created_timestamp": self.created_timestamp
         }
@@ -167,3 +506,109 @@ class Comment(db.Model):
     def __repr__(self):
         return "<Comment {} {} {}>".format(
             self.post_id, self.body, self.created_timestamp)
+
+
+class IdempotencyKey(db.Model):
+    """stored response of a create request, replayed on retries"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return "<IdempotencyKey {} {}>".format(self.key, self.status_code)
+
+
+class Change(db.Model):
+    """append-only log of writes, read in seq order by GET /changes"""
+    __tablename__ = "changes"
+
+    FIELDS = ("seq", "resource", "record_id", "operation",
+              "created_timestamp")
+
+    seq = Column(BigInteger().with_variant(Integer, "sqlite"),
+                 primary_key=True)
+    resource = Column(String(20), nullable=False)
+    record_id = Column(Integer, nullable=False)
+    operation = Column(String(6), nullable=False)
+    created_timestamp = Column(DateTime, server_default=func.now(),
+                               nullable=False)
+    # of created posts and comments, so the rollups still count them
+    # once they have been purged
+    category_id = Column(Integer)
+
+    @classmethod
+    def since(cls, seq, limit, lag=0):
+        """
+        column-only rows of the changes after seq, oldest first, up to
+        the first one younger than lag seconds: a seq is taken at
+        INSERT, so a lower one may still be uncommitted while its
+        transaction runs, and a cursor past it would skip it for good
+        """
+        cutoff = database_now() - timedelta(seconds=lag)
+        rows = columns_query(cls, cls.FIELDS) \
+            .filter(cls.seq > seq).order_by(cls.seq).limit(limit).all()
+        settled = []
+        for row in rows:
+            if row.created_timestamp > cutoff:
+                break
+            settled.append(row)
+        return settled
+
+    def __repr__(self):
+        return "<Change {} {} {} {}>".format(
+            self.seq, self.operation, self.resource, self.record_id)
+
+
+class RegistryVersion(db.Model):
+    """write counter of a table cached by an in-process registry"""
+    __tablename__ = "registry_versions"
+
+    name = Column(String(20), primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+    def __repr__(self):
+        return "<RegistryVersion {} {}>".format(self.name, self.version)
+
+
+class ActivityRollup(db.Model):
+    """posts and comments created per category and hour, see rollup.py"""
+    __tablename__ = "activity_hourly"
+
+    FIELDS = ("hour", "category_id", "posts", "comments")
+
+    hour = Column(DateTime, primary_key=True)
+    # no foreign key, the statistics outlive deleted categories
+    category_id = Column(Integer, primary_key=True)
+    posts = Column(Integer, nullable=False)
+    comments = Column(Integer, nullable=False)
+
+    @classmethod
+    def between(cls, since, until=None, category_id=None):
+        """column-only rows of the hours in [since, until), oldest first"""
+        query = columns_query(cls, cls.FIELDS).filter(cls.hour >= since)
+        if until is not None:
+            query = query.filter(cls.hour < until)
+        if category_id is not None:
+            query = query.filter(cls.category_id == category_id)
+        return query.order_by(cls.hour, cls.category_id)
+
+    def __repr__(self):
+        return "<ActivityRollup {} {} {} {}>".format(
+            self.hour, self.category_id, self.posts, self.comments)
+
+
+class RollupWatermark(db.Model):
+    """last change folded into a rollup, as_of its created_timestamp"""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(20), primary_key=True)
+    seq = Column(BigInteger, nullable=False)
+    as_of = Column(DateTime)
+
+    def __repr__(self):
+        return "<RollupWatermark {} {} {}>".format(
+            self.name, self.seq, self.as_of)
@@ -0,0 +1,148 @@
+"""
+Monthly range partitioning of the comments table (Postgres only)
+
+Comments are partitioned on created_timestamp into one table per month
+(comments_y2021m03, ...) plus a default partition catching anything
+without a month partition. Old months can be detached into standalone
+tables, to be archived or dropped without touching the live table.
+
+Posts stay unpartitioned: comments.post_id references posts.id, and a
+partitioned posts table could only be referenced through a key that
+includes created_timestamp.
+"""
+import re
+from datetime import date
+from sqlalchemy import text
+
+PARTITIONED_TABLES = ('comments',)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(month):
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+
+def parse_month(value):
+    """parses a YYYY-MM string into the first day of that month"""
+    year, month = value.split('-')
+    return date(int(year), int(month), 1)
+
+
+def partition_name(table, month):
+    return "{}_y{:04d}m{:02d}".format(table, month.year, month.month)
+
+
+def is_partition_table(name):
+    """
+    whether name is a month or default partition of a partitioned
+    table, attached or detached for archiving
+    """
+    return any(re.fullmatch(r"{}_(y\d{{4}}m\d{{2}}|default)".format(table),
+                            name)
+               for table in PARTITIONED_TABLES)
+
+
+def is_partitioned(connection, table):
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass(:table)"
+    ), table=table).scalar() is not None
+
+
+def create_month_partition(connection, table, month):
+    month = month_start(month)
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} "
+        "FOR VALUES FROM ('{}') TO ('{}')".format(
+            partition_name(table, month), table,
+            month.isoformat(), next_month(month).isoformat())))
+
+
+def ensure_partitions(connection, table, first_month, months_ahead=3):
+    """creates month partitions from first_month up to months_ahead"""
+    month = month_start(first_month)
+    last = month_start(date.today())
+    for _ in range(months_ahead):
+        last = next_month(last)
+    while month <= last:
+        create_month_partition(connection, table, month)
+        month = next_month(month)
+
+
+def detach_partition(connection, table, month):
+    """
+    detaches a month partition into a standalone table and returns its
+    name, the table can then be dumped and dropped at leisure
+    """
+    name = partition_name(table, month)
+    connection.execute(text(
+        "ALTER TABLE {} DETACH PARTITION {}".format(table, name)))
+    return name
+
+
+def partition_comments(connection, months_ahead=3):
+    """converts the comments table into a monthly partitioned table"""
+    first = connection.execute(text(
+        "SELECT min(created_timestamp) FROM comments")).scalar()
+    first = first.date() if first is not None else date.today()
+
+    for statement in (
+        "ALTER SEQUENCE comments_id_seq OWNED BY NONE",
+        "ALTER TABLE comments RENAME TO comments_unpartitioned",
+        "ALTER INDEX comments_pkey RENAME TO comments_unpartitioned_pkey",
+        "DROP INDEX ix_comments_created_timestamp",
+        "CREATE TABLE comments ("
+        " id integer NOT NULL DEFAULT nextval('comments_id_seq'),"
+        " body varchar(1000) NOT NULL,"
+        " created_timestamp timestamp without time zone"
+        "  NOT NULL DEFAULT now(),"
+        " post_id integer NOT NULL REFERENCES posts (id),"
+        " CONSTRAINT comments_pkey PRIMARY KEY (id, created_timestamp)"
+        ") PARTITION BY RANGE (created_timestamp)",
+        "CREATE TABLE comments_default PARTITION OF comments DEFAULT",
+    ):
+        connection.execute(text(statement))
+
+    ensure_partitions(connection, 'comments', first, months_ahead)
+
+    for statement in (
+        "CREATE INDEX ix_comments_created_timestamp "
+        "ON comments (created_timestamp)",
+        "INSERT INTO comments (id, body, created_timestamp, post_id) "
+        "SELECT id, body, created_timestamp, post_id "
+        "FROM comments_unpartitioned",
+        "DROP TABLE comments_unpartitioned",
+        "ALTER SEQUENCE comments_id_seq OWNED BY comments.id",
+    ):
+        connection.execute(text(statement))
+
+
+def unpartition_comments(connection):
+    """folds a partitioned comments table back into a plain table"""
+    for statement in (
+        "ALTER SEQUENCE comments_id_seq OWNED BY NONE",
+        "ALTER TABLE comments RENAME TO comments_partitioned",
+        "ALTER INDEX comments_pkey RENAME TO comments_partitioned_pkey",
+        "DROP INDEX ix_comments_created_timestamp",
+        "CREATE TABLE comments ("
+        " id integer NOT NULL DEFAULT nextval('comments_id_seq'),"
+        " body varchar(1000) NOT NULL,"
+        " created_timestamp timestamp without time zone"
+        "  NOT NULL DEFAULT now(),"
+        " post_id integer NOT NULL REFERENCES posts (id),"
+        " CONSTRAINT comments_pkey PRIMARY KEY (id)"
+        ")",
+        "CREATE INDEX ix_comments_created_timestamp "
+        "ON comments (created_timestamp)",
+        "INSERT INTO comments (id, body, created_timestamp, post_id) "
+        "SELECT id, body, created_timestamp, post_id "
+        "FROM comments_partitioned",
+        "DROP TABLE comments_partitioned CASCADE",
+        "ALTER SEQUENCE comments_id_seq OWNED BY comments.id",
+    ):
+        connection.execute(text(statement))
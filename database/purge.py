@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+from sqlalchemy import exists, func
+
+from database.models import db, Post, Comment
+
+
+def _delete_batch(model, ids_query):
+    """deletes one batch of rows by id, returns how many were removed"""
+    ids = [row[0] for row in ids_query]
+    if not ids:
+        return 0
+    db.session.query(model).filter(model.id.in_(ids)) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return len(ids)
+
+
+def purge_deleted(batch_size=500, pause=0.1, grace=0):
+    """
+    removes tombstoned comments and posts in small batches, one short
+    transaction each with a pause in between, so purging never holds
+    long locks or saturates the database
+
+    only tombstones older than grace seconds are purged, comments of
+    tombstoned posts go first so the posts can be removed after them
+    returns the number of (comments, posts) removed
+    """
+    # deleted_at is set from the database clock, so compare against it
+    cutoff = db.session.query(func.now()).scalar() - \
+        timedelta(seconds=grace)
+    batches = (
+        (Comment, db.session.query(Comment.id).filter(
+            Comment.deleted_at <= cutoff)),
+        (Comment, db.session.query(Comment.id).join(Post).filter(
+            Post.deleted_at <= cutoff)),
+        (Post, db.session.query(Post.id).filter(
+            Post.deleted_at <= cutoff,
+            ~exists().where(Comment.post_id == Post.id))),
+    )
+
+    removed = {Comment: 0, Post: 0}
+    for model, ids_query in batches:
+        while True:
+            count = _delete_batch(model, ids_query.limit(batch_size))
+            removed[model] += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+
+    return removed[Comment], removed[Post]
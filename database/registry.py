@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from database.models import registry_version, Category
+
+# an immutable copy of the categories table, rows are LONG_FIELDS tuples
+CategorySnapshot = namedtuple(
+    "CategorySnapshot", ("version", "rows", "by_id"))
+
+
+class CategoryRegistry:
+    """
+    in-process snapshot of the categories table
+
+    Readers get the current snapshot without touching the categories
+    table. At most every check_interval seconds the registry version is
+    read (a primary key lookup), and only when a category write has
+    bumped it is the table reloaded into a new snapshot. The snapshot is
+    never mutated, only swapped, so readers need no lock.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def current(self, fresh=False):
+        """the snapshot, re-validated if it is due or fresh is set"""
+        snapshot = self.snapshot
+        now = time.monotonic()
+        if snapshot is not None and not fresh and \
+                now - self.checked_at < self.check_interval:
+            return snapshot
+
+        # the version is read before the rows, so a write racing the
+        # reload only makes the snapshot newer than its version
+        version = registry_version(Category.__tablename__)
+        if snapshot is None or snapshot.version != version:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None or snapshot.version != version:
+                    snapshot = self._load(version)
+                    self.snapshot = snapshot
+        self.checked_at = now
+        return snapshot
+
+    def _load(self, version):
+        rows = tuple(Category.long_query().order_by(Category.id))
+        return CategorySnapshot(
+            version=version,
+            rows=rows,
+            by_id=MappingProxyType({row[0]: row for row in rows}))
+
+    def invalidate(self):
+        """re-validates on the next read, after a write in this worker"""
+        self.checked_at = 0.0
+
+    def all(self):
+        return self.current().rows
+
+    def get(self, id):
+        """
+        the category row, re-validating once before reporting it missing
+        so a category just created by another worker is never rejected
+        """
+        row = self.current().by_id.get(id)
+        if row is None:
+            row = self.current(fresh=True).by_id.get(id)
+        return row
+
+
+def setup_category_registry(app):
+    """binds a CategoryRegistry to a flask application"""
+    # how stale a worker may serve categories written by other workers
+    app.config.setdefault("CATEGORY_REGISTRY_INTERVAL", 1.0)
+
+    registry = CategoryRegistry(
+        check_interval=app.config["CATEGORY_REGISTRY_INTERVAL"])
+    app.extensions["category_registry"] = registry
+    return registry
@@ -0,0 +1,93 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from database.models import db, database_now, ActivityRollup, \
+    RollupWatermark, Change, Post, Comment
+
+WATERMARK = ActivityRollup.__tablename__
+
+
+def hour_of(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _activity(low, high):
+    """
+    posts and comments created by the changes in (low, high], counted
+    per (hour, category_id). read from the change log alone, so rows
+    purged meanwhile still count
+    """
+    columns = {Post.__tablename__: 0, Comment.__tablename__: 1}
+    created = db.session.query(
+        Change.resource, Change.created_timestamp, Change.category_id
+    ).filter(Change.seq > low, Change.seq <= high,
+             Change.operation == "create",
+             Change.resource.in_(columns),
+             Change.category_id.isnot(None))
+
+    counts = defaultdict(lambda: [0, 0])
+    for resource, created_timestamp, category_id in created:
+        column = columns[resource]
+        counts[hour_of(created_timestamp), category_id][column] += 1
+    return counts
+
+
+def _add_to_rollup(hour, category_id, posts, comments):
+    updated = ActivityRollup.query \
+        .filter_by(hour=hour, category_id=category_id) \
+        .update({
+            ActivityRollup.posts: ActivityRollup.posts + posts,
+            ActivityRollup.comments: ActivityRollup.comments + comments
+        }, synchronize_session=False)
+    if not updated:
+        db.session.add(ActivityRollup(
+            hour=hour, category_id=category_id,
+            posts=posts, comments=comments))
+
+
+def rollup_activity(batch_size=1000, pause=0, lag=60):
+    """
+    folds the posts and comments created since the watermark into the
+    hourly rollups, following the change log in seq order. each batch
+    is one transaction that also advances the watermark, so an
+    interrupted run resumes where it stopped and nothing is counted
+    twice. the watermark row is locked meanwhile, concurrent runs queue
+
+    changes younger than lag seconds are left for the next run: a seq
+    is taken at INSERT, so a lower one may still be uncommitted while
+    its transaction runs. returns the number of changes folded in
+    """
+    processed = 0
+    while True:
+        cutoff = database_now() - timedelta(seconds=lag)
+        watermark = RollupWatermark.query.filter_by(name=WATERMARK) \
+            .with_for_update().one_or_none()
+        if watermark is None:
+            watermark = RollupWatermark(name=WATERMARK, seq=0)
+            db.session.add(watermark)
+
+        changes = db.session.query(Change.seq, Change.created_timestamp) \
+            .filter(Change.seq > watermark.seq) \
+            .order_by(Change.seq).limit(batch_size).all()
+        settled = []
+        for change in changes:
+            if change.created_timestamp > cutoff:
+                break
+            settled.append(change)
+        if not settled:
+            db.session.commit()
+            return processed
+
+        last = settled[-1]
+        counts = _activity(watermark.seq, last.seq)
+        for (hour, category_id), (posts, comments) in counts.items():
+            _add_to_rollup(hour, category_id, posts, comments)
+        watermark.seq = last.seq
+        watermark.as_of = last.created_timestamp
+        db.session.commit()
+
+        processed += len(settled)
+        if len(settled) < batch_size:
+            return processed
+        time.sleep(pause)
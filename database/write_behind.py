@@ -0,0 +1,226 @@
+import atexit
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from database.models import db, record_change, Comment, Post
+
+PENDING = "pending"
+CREATED = "created"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+def valid_comment(post_id, body):
+    """
+    checks a comment up front, since a queued comment can no longer
+    be rejected by the database within the request
+    """
+    if not isinstance(post_id, int) or not isinstance(body, str):
+        return False
+    if not body or len(body) > Comment.body.type.length:
+        return False
+    return db.session.query(Post.id) \
+        .filter_by(id=post_id, deleted_at=None).scalar() is not None
+
+
+class CommentWriter:
+    """
+    write-behind queue for new comments
+
+    Validated comments are enqueued in a bounded in-process queue and a
+    background thread inserts them in batches, one transaction per batch.
+    Each enqueued comment gets a pending id whose outcome can be looked up
+    with status() until it is evicted from the bounded status table.
+    Queue and statuses live in the process that enqueued the comment, so
+    write-behind is limited to single-worker deployments.
+    """
+
+    def __init__(self, app, maxsize=1000, batch_size=100,
+                 flush_interval=0.05, put_timeout=0.1, max_statuses=10000):
+        self.app = app
+        self.queue = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_statuses = max_statuses
+        self.statuses = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def _ensure_thread(self):
+        # started lazily, and again after a fork (preloading workers
+        # inherit a dead writer thread) or should it ever have died
+        if self._running():
+            return
+        with self.lock:
+            if not self._running():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self._run, name="comment-writer", daemon=True)
+                self.thread.start()
+
+    def _running(self):
+        return self.thread is not None and self.pid == os.getpid() and \
+            self.thread.is_alive()
+
+    def _set_status(self, pending_id, status):
+        with self.lock:
+            self.statuses[pending_id] = status
+            self.statuses.move_to_end(pending_id)
+            while len(self.statuses) > self.max_statuses:
+                self.statuses.popitem(last=False)
+
+    def enqueue(self, post_id, body, parent=None):
+        """queues a comment and returns its pending id, raises QueueFull"""
+        self._ensure_thread()
+        pending_id = uuid.uuid4().hex
+        self._set_status(pending_id, {"status": PENDING})
+        try:
+            self.queue.put((pending_id, post_id, body, parent),
+                           timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.statuses.pop(pending_id, None)
+            raise QueueFull()
+        return pending_id
+
+    def status(self, pending_id):
+        with self.lock:
+            return self.statuses.get(pending_id)
+
+    def flush(self, timeout=None):
+        """
+        blocks until every queued comment has been written, or until
+        timeout seconds have passed. returns whether the queue drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        try:
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, batch):
+        """
+        stores a batch, returns its comments as serialized by
+        Comment.long(), None for each one that could not be stored
+        """
+        comments = [
+            Comment(post_id, body, parent)
+            for _, post_id, body, parent in batch
+        ]
+        try:
+            db.session.add_all(comments)
+            db.session.flush()
+            for comment in comments:
+                comment.assign_path()
+                record_change(comment, "create", comment.post_category())
+            # serialized before the commit expires them, so nothing is
+            # read back once the comments are stored
+            written = [comment.long() for comment in comments]
+            db.session.commit()
+            return written
+        except Exception:
+            db.session.rollback()
+
+        # one bad row (e.g. its post was deleted meanwhile) must not
+        # drop the whole batch, so retry the rows one by one
+        written = []
+        for _, post_id, body, parent in batch:
+            comment = Comment(post_id, body, parent)
+            try:
+                comment.insert()
+                written.append(comment.long())
+            except Exception:
+                db.session.rollback()
+                written.append(None)
+        return written
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self._next_batch()
+                try:
+                    self._process(batch)
+                except Exception:
+                    # a failing batch must not stop the writer, its
+                    # comments that were not resolved yet are failed
+                    self.app.logger.exception("comment write-behind batch")
+                    for pending_id, _, _, _ in batch:
+                        if self.status(pending_id) == {"status": PENDING}:
+                            self._set_status(pending_id, {"status": FAILED})
+                finally:
+                    self._release(batch)
+
+    def _release(self, batch):
+        """ends the batch's session, rolling back what it left open"""
+        try:
+            db.session.remove()
+        except Exception:
+            self.app.logger.exception("comment write-behind session")
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def _process(self, batch):
+        broker = self.app.extensions["comment_broker"]
+        comments = self._write(batch)
+        for (pending_id, post_id, _, _), comment in zip(batch, comments):
+            if comment is None:
+                self._set_status(pending_id, {"status": FAILED})
+            else:
+                self._set_status(pending_id, {
+                    "status": CREATED,
+                    "post_id": post_id,
+                    "comment_id": comment["id"]
+                })
+                broker.publish_comment(comment)
+
+
+def setup_comment_writer(app):
+    """
+    binds a CommentWriter to a flask application, comments only go
+    through it while COMMENT_WRITE_BEHIND is enabled
+    """
+    app.config.setdefault(
+        "COMMENT_WRITE_BEHIND", bool(os.environ.get("COMMENT_WRITE_BEHIND")))
+    app.config.setdefault("COMMENT_QUEUE_SIZE", 1000)
+    app.config.setdefault("COMMENT_BATCH_SIZE", 100)
+    app.config.setdefault("COMMENT_FLUSH_INTERVAL", 0.05)
+    # how long a request may wait for queue space before back-pressure
+    # kicks in, and whether it then writes synchronously or gets a 503
+    app.config.setdefault("COMMENT_QUEUE_TIMEOUT", 0.1)
+    app.config.setdefault("COMMENT_QUEUE_FULL_SYNC", True)
+    # how long the exit handler waits for queued comments to be written
+    app.config.setdefault("COMMENT_EXIT_FLUSH_TIMEOUT", 5)
+
+    writer = CommentWriter(
+        app,
+        maxsize=app.config["COMMENT_QUEUE_SIZE"],
+        batch_size=app.config["COMMENT_BATCH_SIZE"],
+        flush_interval=app.config["COMMENT_FLUSH_INTERVAL"],
+        put_timeout=app.config["COMMENT_QUEUE_TIMEOUT"])
+    app.extensions["comment_writer"] = writer
+    atexit.register(writer.flush, app.config["COMMENT_EXIT_FLUSH_TIMEOUT"])
+    return writer
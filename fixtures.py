@@ -0,0 +1,235 @@
+"""
+Shared fixtures for the test suites
+
+The app, the schema and the seed data are built once per process. Every
+test then runs inside a transaction that is rolled back when it ends, so
+each test starts from the seed data, in any order, without rebuilding
+anything. The code under test commits as usual: its commits release
+SAVEPOINTs nested in that transaction, and its rollbacks return to them.
+
+Run sharded across processes with pytest-xdist (pytest -n auto), each
+worker then gets its own database, named after the worker. Set
+TEST_DATABASE_URL to test against another database, e.g. sqlite:///
+forum_test.db for a run without Postgres. Only the app built here
+connects, the tests never touch the DATABASE_URL database.
+"""
+import os
+import sys
+import time
+import unittest
+
+from flask import _app_ctx_stack
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from app import create_app
+from database.models import db, Category, Post, Comment
+
+TEST_DATABASE_URL = os.environ.get(
+    'TEST_DATABASE_URL',
+    "postgres://{}/{}".format('localhost:5432', "forum_test"))
+# set by pytest-xdist to gw0, gw1, ... in each of its workers
+WORKER = os.environ.get('PYTEST_XDIST_WORKER', '')
+
+SEED_CATEGORY = {
+    "name": "Programming",
+    "description": "Please don't post about updog"
+}
+SEED_POST = {
+    "title": "Valid New Post",
+    "body": "Thoughts on the updog protocol?"
+}
+SEED_COMMENT = {
+    "body": "What's updog?"
+}
+
+_suite = {}
+
+
+def worker_database_url(url, worker=WORKER):
+    """the database of one worker, created on Postgres if missing"""
+    url = make_url(url)
+    if not worker or not url.database:
+        return str(url)
+
+    if url.drivername.startswith('sqlite'):
+        root, ext = os.path.splitext(url.database)
+        url.database = "{}_{}{}".format(root, worker, ext)
+        return str(url)
+
+    name = "{}_{}".format(url.database, worker)
+    maintenance = create_engine(
+        str(url).rsplit('/', 1)[0] + '/postgres',
+        isolation_level='AUTOCOMMIT')
+    with maintenance.connect() as connection:
+        exists = connection.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %s", name).scalar()
+        if not exists:
+            connection.execute('CREATE DATABASE "{}"'.format(name))
+    maintenance.dispose()
+    url.database = name
+    return str(url)
+
+
+def use_savepoints_on_sqlite(engine):
+    """
+    pysqlite begins transactions on its own and breaks SAVEPOINTs,
+    let SQLAlchemy emit BEGIN instead
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.execute("BEGIN")
+
+    engine.dispose()
+
+
+class SavepointSession(SignallingSession):
+    """
+    a session whose transactions are SAVEPOINTs in the test's
+    transaction, restarted after every commit or rollback
+    """
+
+    closing = False
+
+    def close(self):
+        # discard what the request left uncommitted, without opening
+        # another SAVEPOINT for a session that is going away
+        self.closing = True
+        try:
+            if self.transaction is not None and self.transaction.nested:
+                self.rollback()
+            super().close()
+        finally:
+            self.closing = False
+
+
+@event.listens_for(SavepointSession, "after_transaction_end")
+def restart_savepoint(session, transaction):
+    if transaction.nested and not transaction._parent.nested and \
+            not session.closing:
+        session.expire_all()
+        session.begin_nested()
+
+
+def seed():
+    """the rows every test starts from, all with id 1"""
+    category = Category(**SEED_CATEGORY)
+    category.insert()
+    post = Post(category_id=category.id, **SEED_POST)
+    post.insert()
+    Comment(post.id, **SEED_COMMENT).insert()
+
+
+def build_suite():
+    """app, fresh schema and seed data, once per process"""
+    if _suite:
+        return _suite
+
+    started = time.perf_counter()
+    database_url = worker_database_url(TEST_DATABASE_URL)
+    config = {
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        # re-validate on every read, tests roll category writes back
+        "CATEGORY_REGISTRY_INTERVAL": 0,
+        # serve the changes the test just wrote
+        "CHANGES_LAG": 0,
+    }
+    if database_url.startswith('sqlite'):
+        # the write-behind thread shares the test's connection
+        config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "connect_args": {"check_same_thread": False}
+        }
+
+    app = create_app(config)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            use_savepoints_on_sqlite(db.engine)
+        db.drop_all()
+        db.create_all()
+        seed()
+        db.session.remove()
+
+    _suite.update(
+        app=app,
+        config=dict(app.config),
+        build_time=time.perf_counter() - started,
+        timings={})
+    return _suite
+
+
+class TransactionalTestCase(unittest.TestCase):
+    """runs each test in a transaction that is rolled back afterwards"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = build_suite()["app"]
+
+    def setUp(self):
+        self.started = time.perf_counter()
+        self.client = self.app.test_client
+        self.context = self.app.app_context()
+        self.context.push()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.sessions = db.session
+        db.session = self.savepoint_sessions(self.connection)
+
+    def savepoint_sessions(self, connection):
+        """db.session for the test, its sessions share the connection"""
+        factory = sessionmaker(
+            class_=SavepointSession, db=db, bind=connection, binds={})
+
+        def create_session():
+            session = factory()
+            session.begin_nested()
+            return session
+
+        return scoped_session(
+            create_session, scopefunc=_app_ctx_stack.__ident_func__)
+
+    def tearDown(self):
+        self.app.extensions["comment_writer"].flush()
+        db.session.remove()
+        db.session = self.sessions
+        self.transaction.rollback()
+        self.connection.close()
+        self.context.pop()
+        self.reset_app_state()
+        _suite["timings"][self.id()] = time.perf_counter() - self.started
+
+    def reset_app_state(self):
+        """in-process state that a rolled-back transaction leaves behind"""
+        self.app.config.clear()
+        self.app.config.update(_suite["config"])
+        self.app.extensions["category_registry"].snapshot = None
+        store = self.app.extensions["idempotency_store"]
+        if hasattr(store, "entries"):
+            store.entries.clear()
+        profiler = self.app.extensions["profiler"]
+        profiler.configure(None)
+        profiler.reset()
+
+
+def report_timing(slowest=5, stream=sys.__stderr__):
+    """
+    prints how long the suite took, call it from tearDownModule.
+    written to the real stderr, past pytest's output capture
+    """
+    if not _suite:
+        return
+    timings = _suite["timings"]
+    label = "worker {}: ".format(WORKER) if WORKER else ""
+    stream.write("\n{}{} tests in {:.2f}s, schema and seed built in "
+                 "{:.2f}s\n".format(label, len(timings),
+                                    sum(timings.values()),
+                                    _suite["build_time"]))
+    for test, seconds in sorted(timings.items(),
+                                key=lambda item: -item[1])[:slowest]:
+        stream.write("  {:.3f}s {}\n".format(seconds, test))
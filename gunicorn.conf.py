@@ -0,0 +1,83 @@
+"""
+Production serving profile, loaded by `gunicorn 'app:create_app()'` from
+the root directory. Every setting can be overridden through the
+environment.
+"""
+import multiprocessing
+import os
+import sys
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8080'))
+
+# a gthread worker holds one thread per request for as long as it runs,
+# and an SSE stream runs until its client goes away. Each worker gets
+# GUNICORN_THREADS threads for regular requests plus GUNICORN_STREAM_THREADS
+# for the streams it may hold open. GUNICORN_WORKER_CLASS=gevent serves
+# every request, streams included, as a greenlet instead (requires gevent
+# and psycogreen)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', cpu_count * 2 + 1))
+stream_threads = int(os.environ.get('GUNICORN_STREAM_THREADS', 32))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) + stream_threads
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# the in-process idempotency store and SSE broker only see the requests
+# of their own worker, default to the shared ones across several
+if workers > 1:
+    os.environ.setdefault('IDEMPOTENCY_STORE', 'database')
+    os.environ.setdefault('SSE_PG_NOTIFY', '1')
+
+# import the app once in the master and fork it, sharing its memory.
+# gevent patches the standard library when the worker starts, locks and
+# queues created by a preloaded app would stay unpatched
+preload_app = worker_class != 'gevent'
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+
+# recycle workers periodically, jittered so they do not restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    """
+    the preloaded app may have opened database connections in the
+    master, drop them so workers never share a socket. gevent workers
+    also make psycopg2 yield while waiting on the database, instead of
+    blocking every greenlet of the worker
+    """
+    if server.cfg.worker_class_str == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    from database.models import db
+    db.engine.dispose()
+
+
+def on_starting(server):
+    """
+    refuses, or warns about, per-process features across several
+    workers. comment write-behind queues comments and their pending
+    statuses in the worker that took the request, other workers cannot
+    look them up. /admin/profiling configures and reads the profiler of
+    the worker that serves the request only
+    """
+    if server.cfg.workers <= 1:
+        return
+    if os.environ.get('COMMENT_WRITE_BEHIND'):
+        server.log.error('COMMENT_WRITE_BEHIND requires a single worker, '
+                         'set WEB_CONCURRENCY=1')
+        sys.exit(1)
+    if os.environ.get('IDEMPOTENCY_STORE', 'memory') != 'database':
+        server.log.warning('idempotency keys are kept per worker, set '
+                           'IDEMPOTENCY_STORE=database')
+    if not os.environ.get('SSE_PG_NOTIFY'):
+        server.log.warning('comment events only reach the worker that '
+                           'created them, set SSE_PG_NOTIFY=1')
+    server.log.warning('/admin/profiling only reaches the worker serving '
+                       'each request, set WEB_CONCURRENCY=1 while profiling')
@@ -1,14 +1,65 @@
+from datetime import date
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app import app
+from app import create_app
 from database.models import db
+from database.purge import purge_deleted
+from database.rollup import rollup_activity
+from database.partitions import PARTITIONED_TABLES, is_partitioned, \
+    ensure_partitions, detach_partition as detach_month_partition, \
+    parse_month
 
+app = create_app()
 migrate = Migrate(app, db)
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-a', '--ahead', dest='months_ahead', type=int, default=3)
+def partitions(months_ahead):
+    """creates month partitions up to months_ahead months from now"""
+    with db.engine.begin() as connection:
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(connection, table):
+                ensure_partitions(connection, table, date.today(),
+                                  months_ahead)
+
+
+@manager.option('month', help='month to detach, as YYYY-MM')
+@manager.option('table', choices=PARTITIONED_TABLES)
+def detach_partition(table, month):
+    """detaches a month partition into a standalone table for archiving"""
+    with db.engine.begin() as connection:
+        name = detach_month_partition(connection, table, parse_month(month))
+    print("Detached {}, archive it with pg_dump -t {} and drop it".format(
+        name, name))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=500)
+@manager.option('-p', '--pause', dest='pause', type=float, default=0.1,
+                help='seconds to sleep between batches')
+@manager.option('-g', '--grace', dest='grace', type=int, default=0,
+                help='only purge rows deleted more than this many seconds ago')
+def purge(batch_size, pause, grace):
+    """removes soft-deleted posts and comments in small batches"""
+    comments, posts = purge_deleted(batch_size, pause, grace)
+    print("Purged {} comments and {} posts".format(comments, posts))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=1000)
+@manager.option('-p', '--pause', dest='pause', type=float, default=0,
+                help='seconds to sleep between batches')
+@manager.option('-l', '--lag', dest='lag', type=int, default=60,
+                help='leave changes younger than this many seconds')
+def rollup(batch_size, pause, lag):
+    """folds new posts and comments into the hourly activity rollups"""
+    changes = rollup_activity(batch_size, pause, lag)
+    print("Rolled up {} changes".format(changes))
+
+
 if __name__ == '__main__':
     manager.run()
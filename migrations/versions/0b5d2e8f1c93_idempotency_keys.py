@@ -0,0 +1,40 @@
+"""idempotency key store
+
+Revision ID: 0b5d2e8f1c93
+Revises: f1a2c9e7d480
+Create Date: 2026-10-19 16:00:00.000000
+
+The table used to be created by 3a1f5c2b7d10, which databases stamped
+at that revision never ran, so it is only created where it is missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5d2e8f1c93'
+down_revision = 'f1a2c9e7d480'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'idempotency_keys' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('body', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_idempotency_keys_created_at'),
+                    'idempotency_keys', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_idempotency_keys_created_at'),
+                  table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,55 @@
+"""initial schema
+
+Revision ID: 3a1f5c2b7d10
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+The schema as db.create_all() built it before the migrations existed,
+mark such databases with `python manage.py db stamp 3a1f5c2b7d10`.
+idempotency_keys came later, see 0b5d2e8f1c93.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a1f5c2b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'categories',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=20), nullable=False),
+        sa.Column('description', sa.String(length=100), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table(
+        'posts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=100), nullable=False),
+        sa.Column('body', sa.String(length=1000), nullable=True),
+        sa.Column('created_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'comments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('body', sa.String(length=1000), nullable=False),
+        sa.Column('created_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('comments')
+    op.drop_table('posts')
+    op.drop_table('categories')
@@ -0,0 +1,25 @@
+"""index comments.post_id
+
+Revision ID: 4e9d0b6a2c58
+Revises: d5b7e1c3a942
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e9d0b6a2c58'
+down_revision = 'd5b7e1c3a942'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_comments_post_id'), 'comments', ['post_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_comments_post_id'), table_name='comments')
@@ -0,0 +1,41 @@
+"""category of created posts and comments in the change log
+
+Revision ID: 5c8e3f1a7b24
+Revises: 0b5d2e8f1c93
+Create Date: 2026-10-19 17:00:00.000000
+
+The rollups read it instead of the posts and comments themselves, which
+the purge worker may have removed. Creates not rolled up yet are
+backfilled from the rows still there.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8e3f1a7b24'
+down_revision = '0b5d2e8f1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('changes',
+                  sa.Column('category_id', sa.Integer(), nullable=True))
+    pending = (
+        "changes.operation = 'create' AND changes.seq > coalesce(("
+        " SELECT seq FROM rollup_watermarks"
+        " WHERE name = 'activity_hourly'), 0)")
+    op.execute(
+        "UPDATE changes SET category_id = posts.category_id FROM posts "
+        "WHERE changes.resource = 'posts' "
+        "AND changes.record_id = posts.id AND " + pending)
+    op.execute(
+        "UPDATE changes SET category_id = posts.category_id "
+        "FROM comments JOIN posts ON posts.id = comments.post_id "
+        "WHERE changes.resource = 'comments' "
+        "AND changes.record_id = comments.id AND " + pending)
+
+
+def downgrade():
+    op.drop_column('changes', 'category_id')
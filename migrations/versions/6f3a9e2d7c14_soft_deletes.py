@@ -0,0 +1,42 @@
+"""soft deletes for posts and comments
+
+Revision ID: 6f3a9e2d7c14
+Revises: b2f6c8d1e047
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f3a9e2d7c14'
+down_revision = 'b2f6c8d1e047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('deleted_at', sa.DateTime(),
+                                     nullable=True))
+    op.add_column('comments', sa.Column('deleted_at', sa.DateTime(),
+                                        nullable=True))
+    op.create_index('ix_posts_live_category_id', 'posts',
+                    ['category_id', 'id'],
+                    postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_posts_deleted_at', 'posts', ['deleted_at'],
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_index('ix_comments_live_post_id', 'comments',
+                    ['post_id', 'id'],
+                    postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_comments_deleted_at', 'comments', ['deleted_at'],
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_comments_deleted_at', table_name='comments')
+    op.drop_index('ix_comments_live_post_id', table_name='comments')
+    op.drop_index('ix_posts_deleted_at', table_name='posts')
+    op.drop_index('ix_posts_live_category_id', table_name='posts')
+    op.drop_column('comments', 'deleted_at')
+    op.drop_column('posts', 'deleted_at')
@@ -0,0 +1,40 @@
+"""server-side created_timestamp defaults and indexes
+
+Revision ID: 8c4e2a9f6b31
+Revises: 3a1f5c2b7d10
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2a9f6b31'
+down_revision = '3a1f5c2b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('posts', 'comments'):
+        op.execute('UPDATE {} SET created_timestamp = now() '
+                   'WHERE created_timestamp IS NULL'.format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('created_timestamp',
+                                  existing_type=sa.DateTime(),
+                                  server_default=sa.func.now(),
+                                  nullable=False)
+        op.create_index(op.f('ix_{}_created_timestamp'.format(table)),
+                        table, ['created_timestamp'], unique=False)
+
+
+def downgrade():
+    for table in ('posts', 'comments'):
+        op.drop_index(op.f('ix_{}_created_timestamp'.format(table)),
+                      table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('created_timestamp',
+                                  existing_type=sa.DateTime(),
+                                  server_default=None,
+                                  nullable=True)
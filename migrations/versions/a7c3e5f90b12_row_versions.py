@@ -0,0 +1,29 @@
+"""row versions for optimistic concurrency on categories and posts
+
+Revision ID: a7c3e5f90b12
+Revises: 6f3a9e2d7c14
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5f90b12'
+down_revision = '6f3a9e2d7c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('categories', sa.Column('version', sa.Integer(),
+                                          server_default='1',
+                                          nullable=False))
+    op.add_column('posts', sa.Column('version', sa.Integer(),
+                                     server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('posts', 'version')
+    op.drop_column('categories', 'version')
@@ -0,0 +1,34 @@
+"""append-only change log
+
+Revision ID: b2f6c8d1e047
+Revises: 4e9d0b6a2c58
+Create Date: 2026-10-19 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2f6c8d1e047'
+down_revision = '4e9d0b6a2c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'changes',
+        sa.Column('seq', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                  nullable=False),
+        sa.Column('resource', sa.String(length=20), nullable=False),
+        sa.Column('record_id', sa.Integer(), nullable=False),
+        sa.Column('operation', sa.String(length=6), nullable=False),
+        sa.Column('created_timestamp', sa.DateTime(),
+                  server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('seq')
+    )
+
+
+def downgrade():
+    op.drop_table('changes')
@@ -0,0 +1,34 @@
+"""threaded comment replies stored as materialized paths
+
+Revision ID: c91d4b7e2f36
+Revises: a7c3e5f90b12
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c91d4b7e2f36'
+down_revision = 'a7c3e5f90b12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('comments', sa.Column('parent_id', sa.Integer(),
+                                        nullable=True))
+    op.add_column('comments', sa.Column(
+        'path', sa.String(length=255, collation='C'), nullable=True))
+    # every existing comment is a top-level one
+    op.execute("UPDATE comments SET path = lpad(id::text, 10, '0')")
+    op.create_index('ix_comments_live_post_path', 'comments',
+                    ['post_id', 'path'],
+                    postgresql_where=sa.text('deleted_at IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_comments_live_post_path', table_name='comments')
+    op.drop_column('comments', 'path')
+    op.drop_column('comments', 'parent_id')
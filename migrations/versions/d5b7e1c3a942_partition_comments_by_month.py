@@ -0,0 +1,39 @@
+"""optionally range-partition comments by month
+
+Revision ID: d5b7e1c3a942
+Revises: 8c4e2a9f6b31
+Create Date: 2026-10-19 09:20:00.000000
+
+Only applied on Postgres when PARTITION_COMMENTS is set while
+upgrading, otherwise this revision leaves the schema untouched.
+"""
+import os
+from alembic import op
+
+from database.partitions import is_partitioned, partition_comments, \
+    unpartition_comments
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b7e1c3a942'
+down_revision = '8c4e2a9f6b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return
+    if not os.environ.get('PARTITION_COMMENTS'):
+        return
+    if not is_partitioned(connection, 'comments'):
+        partition_comments(connection)
+
+
+def downgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return
+    if is_partitioned(connection, 'comments'):
+        unpartition_comments(connection)
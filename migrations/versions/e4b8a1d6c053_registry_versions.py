@@ -0,0 +1,32 @@
+"""version counters for in-process registries
+
+Revision ID: e4b8a1d6c053
+Revises: c91d4b7e2f36
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8a1d6c053'
+down_revision = 'c91d4b7e2f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    registry_versions = op.create_table(
+        'registry_versions',
+        sa.Column('name', sa.String(length=20), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(registry_versions, [
+        {'name': 'categories', 'version': 1},
+    ])
+
+
+def downgrade():
+    op.drop_table('registry_versions')
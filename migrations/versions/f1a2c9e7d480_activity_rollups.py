@@ -0,0 +1,55 @@
+"""hourly activity rollups and their watermark
+
+Revision ID: f1a2c9e7d480
+Revises: e4b8a1d6c053
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a2c9e7d480'
+down_revision = 'e4b8a1d6c053'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'activity_hourly',
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('posts', sa.Integer(), nullable=False),
+        sa.Column('comments', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('hour', 'category_id')
+    )
+    op.create_table(
+        'rollup_watermarks',
+        sa.Column('name', sa.String(length=20), nullable=False),
+        sa.Column('seq', sa.BigInteger(), nullable=False),
+        sa.Column('as_of', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+    # the change log does not reach back to the first rows, so roll up
+    # the history from the tables once and follow the log from here on
+    op.execute(
+        "INSERT INTO activity_hourly (hour, category_id, posts, comments) "
+        "SELECT hour, category_id, sum(posts), sum(comments) FROM ("
+        " SELECT date_trunc('hour', created_timestamp) AS hour,"
+        "  category_id, 1 AS posts, 0 AS comments FROM posts"
+        " UNION ALL"
+        " SELECT date_trunc('hour', comments.created_timestamp),"
+        "  posts.category_id, 0, 1"
+        " FROM comments JOIN posts ON posts.id = comments.post_id"
+        ") AS activity GROUP BY hour, category_id")
+    op.execute(
+        "INSERT INTO rollup_watermarks (name, seq, as_of) "
+        "SELECT 'activity_hourly', coalesce(max(seq), 0), "
+        "max(created_timestamp) FROM changes")
+
+
+def downgrade():
+    op.drop_table('rollup_watermarks')
+    op.drop_table('activity_hourly')
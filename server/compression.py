@@ -0,0 +1,101 @@
+import gzip
+import time
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'text/event-stream',
+    'text/html',
+    'text/plain',
+)
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # sync flush so every chunk reaches the client right away
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        yield compressor.process(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+def setup_compression(app):
+    """
+    negotiates gzip/brotli compression for responses of a flask application
+
+    Buffered bodies below COMPRESS_MIN_SIZE bytes are sent as is. Streamed
+    responses are compressed chunk by chunk. Buffered responses report the
+    bytes saved in X-Compression-Saved and the time spent in Server-Timing.
+    """
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    app.config.setdefault("COMPRESS_LEVEL", 6)
+    app.config.setdefault("COMPRESS_BROTLI_QUALITY", 4)
+    app.config.setdefault("COMPRESS_MIMETYPES", COMPRESSIBLE_MIMETYPES)
+
+    encodings = ['gzip']
+    if brotli is not None:
+        encodings.insert(0, 'br')
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or
+                response.status_code in (204, 304) or
+                response.direct_passthrough or
+                'Content-Encoding' in response.headers or
+                response.mimetype not in app.config["COMPRESS_MIMETYPES"]):
+            return response
+
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        if response.is_streamed:
+            if encoding == 'br':
+                response.response = _brotli_stream(
+                    response.response,
+                    app.config["COMPRESS_BROTLI_QUALITY"])
+            else:
+                response.response = _gzip_stream(
+                    response.response, app.config["COMPRESS_LEVEL"])
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Length', None)
+            return response
+
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        started = time.perf_counter()
+        if encoding == 'br':
+            compressed = brotli.compress(
+                data, quality=app.config["COMPRESS_BROTLI_QUALITY"])
+        else:
+            compressed = gzip.compress(
+                data, compresslevel=app.config["COMPRESS_LEVEL"])
+        duration = (time.perf_counter() - started) * 1000
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['X-Compression-Saved'] = \
+            str(len(data) - len(compressed))
+        response.headers.add('Server-Timing',
+                             'compress;dur={:.3f}'.format(duration))
+        return response
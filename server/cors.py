@@ -0,0 +1,49 @@
+ALLOW_HEADERS = 'Content-Type, Authorization, Idempotency-Key, Last-Event-ID'
+ALLOW_METHODS = 'GET, POST, PATCH, DELETE, OPTIONS'
+EXPOSE_HEADERS = 'Idempotent-Replayed, X-Compression-Saved'
+
+
+class CORSMiddleware:
+    """
+    WSGI middleware answering CORS preflights before Flask dispatch
+
+    Preflight requests get a 204 with precomputed headers, cached by
+    browsers for max_age seconds. Every other response gets the
+    Allow-Origin and Expose-Headers headers appended once, without
+    going through an after_request hook.
+    """
+
+    def __init__(self, wsgi_app, allow_origin='*', max_age=7200):
+        self.wsgi_app = wsgi_app
+        self.preflight_headers = [
+            ('Access-Control-Allow-Origin', allow_origin),
+            ('Access-Control-Allow-Headers', ALLOW_HEADERS),
+            ('Access-Control-Allow-Methods', ALLOW_METHODS),
+            ('Access-Control-Max-Age', str(max_age)),
+            ('Content-Length', '0'),
+        ]
+        self.response_headers = [
+            ('Access-Control-Allow-Origin', allow_origin),
+            ('Access-Control-Expose-Headers', EXPOSE_HEADERS),
+        ]
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'OPTIONS' and \
+                'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ:
+            start_response('204 No Content', list(self.preflight_headers))
+            return []
+
+        def start_cors_response(status, headers, exc_info=None):
+            headers.extend(self.response_headers)
+            return start_response(status, headers, exc_info)
+
+        return self.wsgi_app(environ, start_cors_response)
+
+
+def setup_cors(app):
+    """answers CORS preflights and headers for a flask application"""
+    app.config.setdefault("CORS_ALLOW_ORIGIN", "*")
+    app.config.setdefault("CORS_MAX_AGE", 7200)
+    app.wsgi_app = CORSMiddleware(app.wsgi_app,
+                                  app.config["CORS_ALLOW_ORIGIN"],
+                                  app.config["CORS_MAX_AGE"])
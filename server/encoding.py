@@ -0,0 +1,59 @@
+import os
+from flask.json import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# "auto" uses orjson when it is installed, "stdlib" forces the fallback
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+    JSONEncoder backed by orjson
+
+    Flask's jsonify still drives the encoder through json.dumps, so only
+    encode() is swapped. Datetimes are passed through to default() so the
+    API keeps Flask's HTTP date format, unless JSON_ISO_DATETIMES is set,
+    in which case orjson serializes them natively as ISO 8601.
+    Pretty-printing and anything orjson rejects (e.g. non-string keys)
+    falls back to the standard library encoder.
+    """
+    iso_datetimes = False
+
+    def encode(self, o):
+        if self.indent is not None:
+            return super().encode(o)
+
+        option = 0
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if not self.iso_datetimes:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+
+        try:
+            return orjson.dumps(o, default=self.default,
+                                option=option).decode()
+        except TypeError:
+            return super().encode(o)
+
+
+class FastISOJSONEncoder(FastJSONEncoder):
+    iso_datetimes = True
+
+
+def setup_json(app, backend=JSON_BACKEND):
+    """binds the fastest available JSON encoder to a flask application"""
+    app.config.setdefault("JSONIFY_PRETTYPRINT_REGULAR", False)
+    app.config.setdefault("JSON_ISO_DATETIMES", False)
+
+    if backend == 'stdlib' or orjson is None:
+        app.json_encoder = JSONEncoder
+        return
+
+    if app.config["JSON_ISO_DATETIMES"]:
+        app.json_encoder = FastISOJSONEncoder
+    else:
+        app.json_encoder = FastJSONEncoder
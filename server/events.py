@@ -0,0 +1,199 @@
+import json as stdlib_json
+import os
+import queue
+import select
+import threading
+import time
+from flask import current_app, json
+from sqlalchemy import text
+
+# Postgres channel used when SSE_PG_NOTIFY fans events out across workers
+NOTIFY_CHANNEL = 'comment_events'
+SSE_PG_NOTIFY = bool(os.environ.get('SSE_PG_NOTIFY'))
+
+
+class Subscription:
+    """
+    one SSE connection, holding at most buffer_size undelivered events
+    a consumer falling further behind is cut off rather than buffered
+    """
+
+    def __init__(self, buffer_size):
+        self.events = queue.Queue(buffer_size)
+        self.overflowed = False
+
+    def offer(self, event_id, event):
+        try:
+            self.events.put_nowait((event_id, event))
+        except queue.Full:
+            self.overflowed = True
+
+
+def format_event(event_id, data, event='comment'):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event, data)
+
+
+class CommentBroker:
+    """in-process pub/sub of new comments, keyed by post id"""
+
+    def __init__(self, buffer_size=100, keepalive=15, fanout=None):
+        self.buffer_size = buffer_size
+        self.keepalive = keepalive
+        self.fanout = fanout
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, post_id):
+        if self.fanout is not None:
+            self.fanout.start(self)
+        subscription = Subscription(self.buffer_size)
+        with self.lock:
+            self.subscribers.setdefault(post_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, post_id, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(post_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[post_id]
+
+    def dispatch(self, post_id, event_id, data):
+        """hands an event to the subscribers of this worker"""
+        with self.lock:
+            subscribers = list(self.subscribers.get(post_id, ()))
+        event = format_event(event_id, data)
+        for subscription in subscribers:
+            subscription.offer(event_id, event)
+
+    def publish_comment(self, comment):
+        """
+        publishes a comment, as serialized by Comment.long(),
+        must be called within an app context. the comment is already
+        stored, so a failure is logged rather than raised: subscribers
+        catch up through Last-Event-ID when they reconnect
+        """
+        try:
+            data = json.dumps(comment)
+            if self.fanout is not None:
+                self.fanout.notify(comment["post_id"], comment["id"], data)
+            else:
+                self.dispatch(comment["post_id"], comment["id"], data)
+        except Exception:
+            current_app.logger.exception(
+                "publishing comment %s", comment.get("id"))
+
+    def stream(self, post_id, subscription, backlog=()):
+        """
+        yields the SSE stream of a subscription, starting with the
+        backlog of (event_id, data) pairs, with keepalive comments in
+        between events
+        """
+        last_id = 0
+        backlog_ids = set()
+        try:
+            yield 'retry: 3000\n\n'
+            for event_id, data in backlog:
+                last_id = event_id
+                backlog_ids.add(event_id)
+                yield format_event(event_id, data)
+            while True:
+                try:
+                    event_id, event = subscription.events.get(
+                        timeout=self.keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                # skip events the backlog already covered. comments
+                # commit out of id order, so a live event with a lower
+                # id than the last one sent is still new
+                if event_id not in backlog_ids:
+                    last_id = event_id
+                    yield event
+                if subscription.overflowed and subscription.events.empty():
+                    yield format_event(last_id, '{}', event='overflow')
+                    return
+        finally:
+            self.unsubscribe(post_id, subscription)
+
+
+class PostgresFanout:
+    """
+    relays published events through LISTEN/NOTIFY, so every worker
+    delivers comments created by any other worker
+    """
+
+    def __init__(self, db, logger, retry_interval=1.0):
+        self.db = db
+        self.logger = logger
+        self.retry_interval = retry_interval
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _running(self):
+        return self.thread is not None and self.pid == os.getpid() and \
+            self.thread.is_alive()
+
+    def start(self, broker):
+        if self._running():
+            return
+        with self.lock:
+            if not self._running():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self._listen, args=(broker,),
+                    name="comment-events", daemon=True)
+                self.thread.start()
+
+    def notify(self, post_id, event_id, data):
+        payload = stdlib_json.dumps([post_id, event_id, data])
+        with self.db.engine.connect() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)")
+                .execution_options(autocommit=True),
+                channel=NOTIFY_CHANNEL, payload=payload)
+
+    def _listen(self, broker):
+        # reconnects when the database goes away, notifications sent
+        # while disconnected are missed
+        while True:
+            try:
+                self._relay(broker)
+            except Exception:
+                self.logger.exception("listening on %s", NOTIFY_CHANNEL)
+            time.sleep(self.retry_interval)
+
+    def _relay(self, broker):
+        connection = self.db.engine.raw_connection()
+        connection.detach()
+        try:
+            connection.connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute('LISTEN {}'.format(NOTIFY_CHANNEL))
+            raw = connection.connection
+            while True:
+                if select.select([raw], [], [], broker.keepalive) == \
+                        ([], [], []):
+                    # an idle socket does not notice a lost server
+                    cursor.execute('SELECT 1')
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    notify = raw.notifies.pop(0)
+                    broker.dispatch(*stdlib_json.loads(notify.payload))
+        finally:
+            connection.close()
+
+
+def setup_events(app, db, pg_notify=SSE_PG_NOTIFY):
+    """binds a CommentBroker to a flask application"""
+    app.config.setdefault("SSE_KEEPALIVE", 15)
+    app.config.setdefault("SSE_BUFFER_SIZE", 100)
+
+    fanout = PostgresFanout(db, app.logger) if pg_notify else None
+    broker = CommentBroker(app.config["SSE_BUFFER_SIZE"],
+                           app.config["SSE_KEEPALIVE"], fanout)
+    app.extensions["comment_broker"] = broker
+    return broker
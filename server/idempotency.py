@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, abort, current_app, make_response
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from database.models import db, IdempotencyKey
+
+IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'memory')
+
+'''
+Key stores
+
+claim(key, fingerprint) reserves a key and returns None, or returns the
+(fingerprint, status_code, body) already stored under it. A status_code
+of None means the first request is still in flight, unless its claim
+is older than the lease: its worker was then killed mid-request, e.g.
+by the gunicorn timeout, and the key can be claimed again.
+'''
+
+
+class MemoryKeyStore:
+    """per-process key store, evicts by age and size"""
+
+    def __init__(self, ttl, max_keys, lease):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.lease = lease
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if (len(self.entries) <= self.max_keys and
+                    entry[0] > now - self.ttl):
+                break
+            del self.entries[key]
+
+    def claim(self, key, fingerprint):
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            entry = self.entries.get(key)
+            if entry is not None and (entry[2] is not None or
+                                      entry[0] > now - self.lease):
+                return entry[1:]
+            self.entries[key] = (now, fingerprint, None, None)
+            self.entries.move_to_end(key)
+        return None
+
+    def save(self, key, status_code, body):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = (entry[0], entry[1], status_code, body)
+
+    def release(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class DatabaseKeyStore:
+    """key store shared by all workers through the idempotency_keys table"""
+
+    def __init__(self, ttl, lease, evict_every=100):
+        self.ttl = ttl
+        self.lease = lease
+        self.evict_every = evict_every
+        self.claims = 0
+
+    def _evict(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        IdempotencyKey.query \
+            .filter(IdempotencyKey.created_at < cutoff) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+    def claim(self, key, fingerprint):
+        self.claims += 1
+        if self.claims % self.evict_every == 0:
+            self._evict()
+
+        try:
+            db.session.add(IdempotencyKey(
+                key=key, fingerprint=fingerprint,
+                created_at=datetime.utcnow()))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        now = datetime.utcnow()
+        expired = or_(
+            IdempotencyKey.created_at < now - timedelta(seconds=self.ttl),
+            and_(IdempotencyKey.status_code.is_(None),
+                 IdempotencyKey.created_at <
+                 now - timedelta(seconds=self.lease)))
+        entry = db.session.query(
+            IdempotencyKey.fingerprint, IdempotencyKey.status_code,
+            IdempotencyKey.body).filter_by(key=key).first()
+        if entry is None or IdempotencyKey.query \
+                .filter(IdempotencyKey.key == key, expired) \
+                .delete(synchronize_session=False):
+            # released in between, expired, or an abandoned claim: treat
+            # it as a fresh key. of concurrent retries only one deletes
+            # it, the others then find its new claim in flight
+            db.session.commit()
+            return self.claim(key, fingerprint)
+        return tuple(entry)
+
+    def save(self, key, status_code, body):
+        IdempotencyKey.query.filter_by(key=key).update({
+            "status_code": status_code,
+            "body": body
+        })
+        db.session.commit()
+
+    def release(self, key):
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(key=key).delete()
+        db.session.commit()
+
+
+def setup_idempotency(app, store=IDEMPOTENCY_STORE):
+    """binds an Idempotency-Key store to a flask application"""
+    app.config.setdefault("IDEMPOTENCY_TTL", 24 * 60 * 60)
+    app.config.setdefault("IDEMPOTENCY_MAX_KEYS", 10000)
+    # longer than any request may run (gunicorn kills it after 30s), a
+    # claim still in flight after that was abandoned
+    app.config.setdefault("IDEMPOTENCY_LEASE", 60)
+
+    if store == 'database':
+        key_store = DatabaseKeyStore(app.config["IDEMPOTENCY_TTL"],
+                                     app.config["IDEMPOTENCY_LEASE"])
+    else:
+        key_store = MemoryKeyStore(app.config["IDEMPOTENCY_TTL"],
+                                   app.config["IDEMPOTENCY_MAX_KEYS"],
+                                   app.config["IDEMPOTENCY_LEASE"])
+    app.extensions["idempotency_store"] = key_store
+    return key_store
+
+
+'''
+@idempotent decorator
+    replays the stored response of a successful request sent with the
+    same Idempotency-Key header, without calling the view again
+
+    keys are scoped per user and path, reusing a key with a different
+    request body is a 422, and retrying while the first request is
+    still running is a 409
+    must be applied below @requires_auth so the payload is available
+'''
+
+
+def idempotent(f):
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is None:
+            return f(payload, *args, **kwargs)
+        if not idempotency_key or len(idempotency_key) > 255:
+            abort(400)
+
+        subject = payload.get('sub', '') if isinstance(payload, dict) else ''
+        key = hashlib.sha256('{}\n{}\n{}'.format(
+            subject, request.path, idempotency_key).encode()).hexdigest()
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        store = current_app.extensions["idempotency_store"]
+        stored = store.claim(key, fingerprint)
+        if stored is not None:
+            stored_fingerprint, status_code, body = stored
+            if stored_fingerprint != fingerprint:
+                abort(422)
+            if status_code is None:
+                abort(409)
+            response = current_app.response_class(
+                body, status=status_code,
+                mimetype=current_app.config["JSONIFY_MIMETYPE"])
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(f(payload, *args, **kwargs))
+        except Exception:
+            store.release(key)
+            raise
+
+        if 200 <= response.status_code < 300:
+            store.save(key, response.status_code, response.get_data())
+        else:
+            store.release(key)
+        return response
+
+    return wrapper
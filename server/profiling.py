@@ -0,0 +1,162 @@
+import cProfile
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import request
+
+MODES = ('sampling', 'cprofile')
+
+
+def frame_label(code):
+    return '{} ({}:{})'.format(code.co_name,
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+def collapse_frame(frame):
+    """the stack of frame as a root-first, semicolon-separated string"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def collapse_stats(stats):
+    """
+    caller;callee edges of a cProfile run weighted by their own time
+    in microseconds, cProfile does not record deeper stacks
+    """
+    edges = Counter()
+    for (filename, lineno, name), (_, _, _, _, callers) in \
+            stats.stats.items():
+        callee = '{} ({}:{})'.format(name, os.path.basename(filename),
+                                     lineno)
+        for (caller_file, caller_line, caller_name), caller_stats in \
+                callers.items():
+            caller = '{} ({}:{})'.format(
+                caller_name, os.path.basename(caller_file), caller_line)
+            edges['{};{}'.format(caller, callee)] += \
+                int(caller_stats[2] * 1e6)
+    return edges
+
+
+class Profiler:
+    """
+    per-route profiling of a sampled fraction of requests
+
+    'sampling' walks the stacks of the threads serving sampled requests
+    every interval seconds, 'cprofile' runs cProfile around each sampled
+    request. Both aggregate collapsed stacks per route, ready for
+    flamegraph.pl or speedscope. When disabled, requests only pay for
+    one attribute check.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.rate = 0.0
+        self.interval = 0.005
+        self.stacks = defaultdict(Counter)
+        self.requests = Counter()
+        self.active = {}
+        self.lock = threading.Lock()
+        self.sampler = None
+
+    def configure(self, mode, rate=0.01, interval=0.005):
+        if mode is not None and mode not in MODES:
+            raise ValueError('unknown profiling mode: {}'.format(mode))
+        if not 0 <= rate <= 1 or interval <= 0:
+            raise ValueError('invalid profiling rate or interval')
+
+        self.rate = rate
+        self.interval = interval
+        self.mode = mode
+        if mode == 'sampling' and (self.sampler is None or
+                                   not self.sampler.is_alive()):
+            self.sampler = threading.Thread(
+                target=self._sample, name="profiler", daemon=True)
+            self.sampler.start()
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.requests.clear()
+
+    def status(self):
+        with self.lock:
+            return {
+                "worker": os.getpid(),
+                "mode": self.mode,
+                "rate": self.rate,
+                "interval": self.interval,
+                "requests": dict(self.requests)
+            }
+
+    def collapsed(self, route=None):
+        """collapsed stack lines, 'frame;frame;frame weight'"""
+        with self.lock:
+            routes = [route] if route is not None else list(self.stacks)
+            return {
+                name: ['{} {}'.format(stack, weight)
+                       for stack, weight in self.stacks[name].most_common()]
+                for name in routes if name in self.stacks
+            }
+
+    def start_request(self):
+        if self.mode is None or random.random() >= self.rate:
+            return
+        route = request.url_rule.rule if request.url_rule else request.path
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            self.active[threading.get_ident()] = (route, profile)
+            profile.enable()
+        else:
+            self.active[threading.get_ident()] = (route, None)
+
+    def finish_request(self):
+        entry = self.active.pop(threading.get_ident(), None)
+        if entry is None:
+            return
+        route, profile = entry
+        if profile is not None:
+            profile.disable()
+            edges = collapse_stats(pstats.Stats(profile))
+        with self.lock:
+            self.requests[route] += 1
+            if profile is not None:
+                self.stacks[route].update(edges)
+
+    def _sample(self):
+        while self.mode == 'sampling':
+            time.sleep(self.interval)
+            active = dict(self.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, (route, _) in active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.stacks[route][collapse_frame(frame)] += 1
+
+
+def setup_profiling(app):
+    """binds a Profiler, disabled until configured, to a flask app"""
+    profiler = Profiler()
+
+    @app.before_request
+    def start_profiling():
+        if profiler.mode is not None:
+            profiler.start_request()
+
+    @app.teardown_request
+    def finish_profiling(exception=None):
+        if profiler.active:
+            profiler.finish_request()
+
+    app.extensions["profiler"] = profiler
+    return profiler
@@ -1,30 +1,35 @@
+import gzip
+import io
 import os
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timedelta
+from unittest import mock
 
-from app import create_app
-from database.models import (
-    setup_db, db_drop_and_create_all, Post, Comment, Category
-)
+from jose import jwt
 
-# PYTHON UNIT TESTS ARE RAN IN ALPHABETICAL ORDER!
+from database.models import db, Post, Comment, Category, IdempotencyKey
+from database.purge import purge_deleted
+from database.rollup import rollup_activity
+from server.idempotency import DatabaseKeyStore, MemoryKeyStore
+from fixtures import TransactionalTestCase, report_timing
+from auth import auth
+from benchmarks.bench_jwt import make_keys
 
 # Disabling Auth0 calls when testing core functionality
 os.environ["DISABLE_AUTH0"] = "1"
 
 
-class ForumTestCase(unittest.TestCase):
+def tearDownModule():
+    report_timing()
+
+
+class ForumTestCase(TransactionalTestCase):
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.database_name = "forum_test"
-        self.database_path = "postgres://{}/{}" \
-            .format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-        # db_drop_and_create_all()
+        """Define test variables and start the test's transaction."""
+        super().setUp()
 
         self.VALID_NEW_CATEGORY = {
             "name": "Valid Test Category",
@@ -67,26 +72,17 @@ class ForumTestCase(unittest.TestCase):
             "comment_id": 1
         }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            self.db.drop_all()
-            # create all tables
-            self.db.create_all()
-
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
-
     """
-    NOTE: unittest by default is ran in alphabetical order
-    To get around an issue with test failing due to dependencies
-    on previous test, the tests have alphanumeric prefix which
-    allows them to be ran in a specific order. At a later point
-    I may change the tests to work independently of each other.
+    NOTE: every test starts from the seed data of fixtures.py (category,
+    post and comment 1) and its writes are rolled back afterwards, so
+    the tests run in any order and in parallel (pytest -n auto)
     """
 
+    def create_reply(self, parent_id):
+        response = self.client().post('/comments', json={
+            "post_id": 1, "parent_id": parent_id, "body": "A reply"})
+        return json.loads(response.data)["created_comment_id"]
+
     def test_a_01_health(self):
         response = self.client().get('/')
         data = json.loads(response.data)
@@ -95,6 +91,23 @@ class ForumTestCase(unittest.TestCase):
         self.assertIn('health', data)
         self.assertEqual(data['health'], 'Running!')
 
+    def test_a_01_preflight(self):
+        response = self.client().options('/posts', headers={
+            'Origin': 'https://example.com',
+            'Access-Control-Request-Method': 'POST'
+        })
+
+        self.assertEqual(response.status_code, 204)
+        self.assertIn('Access-Control-Max-Age', response.headers)
+        self.assertIn('Authorization',
+                      response.headers['Access-Control-Allow-Headers'])
+
+    def test_a_01_cors_headers_once(self):
+        response = self.client().get('/')
+
+        self.assertEqual(
+            response.headers.getlist('Access-Control-Allow-Origin'), ['*'])
+
     def test_a_02_create_category(self):
         response = self.client() \
             .post('/categories', json=self.VALID_NEW_CATEGORY)
@@ -131,6 +144,22 @@ class ForumTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertIn('message', data)
 
+    def test_a_05_create_post_category_string_id(self):
+        post = dict(self.VALID_NEW_POST, category_id="1")
+        response = self.client().post('/posts', json=post)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('created_post_id', data)
+
+    def test_a_05_create_post_category_422(self):
+        post = dict(self.VALID_NEW_POST, category_id=10000)
+        response = self.client().post('/posts', json=post)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data["success"])
+
     def test_a_06_create_comment(self):
         response = self.client() \
             .post('/comments', json=self.VALID_NEW_COMMENT)
@@ -140,6 +169,23 @@ class ForumTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertIn('created_comment_id', data)
 
+    def test_a_06_create_comment_publish_fails(self):
+        broker = self.app.extensions["comment_broker"]
+
+        def fail(post_id, event_id, data):
+            raise RuntimeError("NOTIFY failed")
+
+        broker.dispatch = fail
+        try:
+            response = self.client() \
+                .post('/comments', json=self.VALID_NEW_COMMENT)
+        finally:
+            del broker.dispatch
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('created_comment_id', data)
+
     def test_a_07_create_comment_422(self):
         response = self.client() \
             .post('/comments', json=self.INVALID_NEW_COMMENT)
@@ -149,6 +195,113 @@ class ForumTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertIn('message', data)
 
+    def test_a_08_create_post_idempotent(self):
+        headers = {'Idempotency-Key': 'test-a-07'}
+        first = self.client() \
+            .post('/posts', json=self.VALID_NEW_POST, headers=headers)
+        retry = self.client() \
+            .post('/posts', json=self.VALID_NEW_POST, headers=headers)
+        data = json.loads(retry.data)
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertTrue(data["success"])
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(data["created_post_id"],
+                         json.loads(first.data)["created_post_id"])
+
+    def test_a_08_idempotency_claim_lease(self):
+        past = datetime.utcnow() - timedelta(minutes=2)
+        for store in (DatabaseKeyStore(ttl=3600, lease=60),
+                      MemoryKeyStore(ttl=3600, max_keys=10, lease=60)):
+            self.assertIsNone(store.claim("key", "first"))
+            self.assertEqual(store.claim("key", "retry"),
+                             ("first", None, None))
+
+            # the worker holding the claim was killed mid-request
+            if isinstance(store, DatabaseKeyStore):
+                IdempotencyKey.query.filter_by(key="key") \
+                    .update({"created_at": past})
+                db.session.commit()
+            else:
+                store.entries["key"] = (time.monotonic() - 120, "first",
+                                        None, None)
+            self.assertIsNone(store.claim("key", "retry"))
+            self.assertEqual(store.claim("key", "retry"),
+                             ("retry", None, None))
+
+    def test_a_09_create_comment_write_behind(self):
+        self.app.config["COMMENT_WRITE_BEHIND"] = True
+        response = self.client() \
+            .post('/comments', json=self.VALID_NEW_COMMENT)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(data["success"])
+        self.assertIn('pending_comment_id', data)
+
+        self.app.extensions["comment_writer"].flush()
+        response = self.client() \
+            .get('/comments/pending/' + data["pending_comment_id"])
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["status"], "created")
+        self.assertIn('comment_id', data)
+
+    def test_a_09_write_behind_survives_failed_batch(self):
+        self.app.config["COMMENT_WRITE_BEHIND"] = True
+        writer = self.app.extensions["comment_writer"]
+        process = writer._process
+
+        def fail_once(batch):
+            writer._process = process
+            raise RuntimeError("database went away")
+
+        writer._process = fail_once
+        failed = json.loads(self.client().post(
+            '/comments', json=self.VALID_NEW_COMMENT).data)
+        self.assertTrue(writer.flush(timeout=5))
+        written = json.loads(self.client().post(
+            '/comments', json=self.VALID_NEW_COMMENT).data)
+        self.assertTrue(writer.flush(timeout=5))
+
+        self.assertEqual(
+            writer.status(failed["pending_comment_id"])["status"], "failed")
+        self.assertEqual(
+            writer.status(written["pending_comment_id"])["status"],
+            "created")
+        self.assertEqual(writer.queue.unfinished_tasks, 0)
+
+    def test_a_10_create_comment_write_behind_422(self):
+        self.app.config["COMMENT_WRITE_BEHIND"] = True
+        response = self.client() \
+            .post('/comments', json={"post_id": 10000, "body": "Orphan"})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data["success"])
+        self.assertIn('message', data)
+
+    def test_a_11_create_reply(self):
+        reply = {"post_id": 1, "parent_id": 1, "body": "A reply"}
+        response = self.client().post('/comments', json=reply)
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+
+        reply["parent_id"] = data["created_comment_id"]
+        response = self.client().post('/comments', json=reply)
+        self.assertEqual(response.status_code, 200)
+
+    def test_a_12_create_reply_422(self):
+        response = self.client().post('/comments', json={
+            "post_id": 1, "parent_id": 10000, "body": "Orphan reply"})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data["success"])
+
     def test_b_01_get_categories(self):
         response = self.client().get('/categories')
         data = json.loads(response.data)
@@ -167,6 +320,10 @@ class ForumTestCase(unittest.TestCase):
         self.assertTrue(len(data))
         self.assertTrue(data["success"])
         self.assertIn('posts', data)
+        self.assertEqual(set(data["posts"][0]),
+                         {"id", "title", "created_timestamp"})
+        self.assertTrue(
+            data["posts"][0]["created_timestamp"].endswith("GMT"))
 
     def test_b_03_get_post_from_categories(self):
         response = self.client().get('/categories/1')
@@ -185,6 +342,231 @@ class ForumTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(len(data))
         self.assertTrue(data["success"])
+        self.assertTrue(all(comment["post_id"] == 1
+                            for comment in data["comments"]))
+
+    def test_b_04_get_posts_gzip(self):
+        self.app.config["COMPRESS_MIN_SIZE"] = 0
+        response = self.client() \
+            .get('/posts', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(response.data))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('X-Compression-Saved', response.headers)
+        self.assertTrue(data["success"])
+        self.assertIn('posts', data)
+
+    def test_b_05_get_posts_since(self):
+        response = self.client().get('/posts?since=2000-01-01T00:00:00')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+        self.assertTrue(len(data["posts"]))
+
+        response = self.client().get('/posts?until=2000-01-01T00:00:00')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["posts"], [])
+
+    def test_b_06_get_posts_by_ids(self):
+        response = self.client().get('/posts?ids=1,10000')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+        self.assertEqual([post["id"] for post in data["posts"]], [1])
+        self.assertEqual(data["missing"], [10000])
+        self.assertIn('comment_count', data["posts"][0])
+
+    def test_b_07_get_posts_by_ids_422(self):
+        response = self.client().get('/posts?ids=1,abc')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data["success"])
+        self.assertIn('message', data)
+
+    def test_b_08_get_changes(self):
+        response = self.client().get('/changes?since=0&limit=2')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+        self.assertEqual(len(data["changes"]), 2)
+        self.assertEqual(data["changes"][0]["operation"], "create")
+        self.assertEqual(data["next_since"], data["changes"][-1]["seq"])
+
+        response = self.client() \
+            .get('/changes?since={}'.format(data["next_since"]))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["changes"])
+        self.assertTrue(all(change["seq"] > 2
+                            for change in data["changes"]))
+
+    def test_b_08_get_changes_lag(self):
+        self.app.config["CHANGES_LAG"] = 3600
+        response = self.client().get('/changes?since=0')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["changes"], [])
+        self.assertEqual(data["next_since"], 0)
+
+    def test_b_08_get_changes_422(self):
+        for limit in ("-5", "0", "many"):
+            response = self.client().get('/changes?limit=' + limit)
+            self.assertEqual(response.status_code, 422)
+
+    def test_b_09_get_post_events(self):
+        response = self.client().get('/posts/1/events',
+                                     headers={'Last-Event-ID': '0'},
+                                     buffered=False)
+        events = iter(response.response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(next(events), b'retry: 3000\n\n')
+        self.assertTrue(next(events).startswith(b'id: '))
+        response.close()
+
+    def test_b_09_post_events_out_of_order(self):
+        broker = self.app.extensions["comment_broker"]
+        subscription = broker.subscribe(1)
+        events = broker.stream(1, subscription, backlog=[(9, '{}')])
+        next(events)
+        self.assertTrue(next(events).startswith('id: 9\n'))
+
+        for event_id in (11, 9, 10):
+            broker.dispatch(1, event_id, '{}')
+        self.assertTrue(next(events).startswith('id: 11\n'))
+        self.assertTrue(next(events).startswith('id: 10\n'))
+        events.close()
+
+    def test_b_10_get_post_events_404(self):
+        response = self.client().get('/posts/10000/events')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data["success"])
+        self.assertIn('message', data)
+
+    def test_b_11_profiling(self):
+        for mode in ('cprofile', 'sampling'):
+            response = self.client().patch('/admin/profiling', json={
+                "mode": mode,
+                "rate": 1,
+                "interval": 0.001
+            })
+            self.assertEqual(response.status_code, 200)
+
+            self.client().get('/posts')
+            response = self.client().get('/admin/profiling')
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data["profiling"]["mode"], mode)
+            self.assertEqual(data["profiling"]["worker"], os.getpid())
+            self.assertEqual(data["profiling"]["requests"]["/posts"], 1)
+            self.client().delete('/admin/profiling')
+
+        self.client().patch('/admin/profiling', json={"mode": None})
+
+    def test_b_12_profiling_422(self):
+        response = self.client() \
+            .patch('/admin/profiling', json={"mode": "strace"})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data["success"])
+
+    def test_b_13_get_comment_threads(self):
+        self.create_reply(self.create_reply(1))
+        response = self.client().get('/posts/1/comments?threads=1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data["comments"]), 1)
+        thread = data["comments"][0]
+        self.assertIsNone(thread["parent_id"])
+        self.assertEqual(thread["replies"][0]["parent_id"], thread["id"])
+        self.assertEqual(len(thread["replies"][0]["replies"]), 1)
+        self.assertEqual(data["next_after"], thread["id"])
+
+        response = self.client().get('/posts/1/comments?depth=1')
+        data = json.loads(response.data)
+        self.assertFalse(data["comments"][0]["replies"][0]["replies"])
+
+    def test_b_14_get_comment_subtree(self):
+        self.create_reply(self.create_reply(1))
+        response = self.client().get('/posts/1/comments?threads=1')
+        reply = json.loads(response.data)["comments"][0]["replies"][0]
+
+        response = self.client() \
+            .get('/posts/1/comments?root={}'.format(reply["id"]))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([thread["id"] for thread in data["comments"]],
+                         [reply["id"]])
+        self.assertEqual(len(data["comments"][0]["replies"]), 1)
+
+        response = self.client().get('/posts/1/comments?root=10000')
+        self.assertEqual(response.status_code, 404)
+
+    def test_b_15_category_registry(self):
+        registry = self.app.extensions["category_registry"]
+        snapshot = registry.current()
+        self.assertIs(registry.current(), snapshot)
+
+        # written behind the registry's back, as by another worker
+        category = Category("Registry", "Created elsewhere")
+        category.insert()
+        self.assertIsNotNone(registry.get(category.id))
+        self.assertGreater(registry.current().version, snapshot.version)
+
+    def test_b_16_get_stats(self):
+        self.client().post('/posts', json=self.VALID_NEW_POST)
+        self.assertEqual(rollup_activity(lag=0), 4)
+        self.assertEqual(rollup_activity(lag=0), 0)
+
+        response = self.client().get('/stats?category_id=1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+        self.assertEqual(data["totals"], {"posts": 2, "comments": 1})
+        self.assertEqual(data["stats"][0]["category_id"], 1)
+        self.assertIsNotNone(data["as_of"])
+
+    def test_b_16_get_stats_utc_offset(self):
+        response = self.client().get(
+            '/stats?since=2026-10-19T02:00:00%2B02:00'
+            '&until=2026-10-19T01:00:00%2B00:00')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data["success"])
+
+    def test_b_16_get_stats_purged(self):
+        self.client().post('/posts', json=self.VALID_NEW_POST)
+        self.client().delete('/posts/1')
+        self.assertEqual(purge_deleted(pause=0), (1, 1))
+        rollup_activity(lag=0)
+
+        data = json.loads(self.client().get('/stats').data)
+        self.assertEqual(data["totals"], {"posts": 2, "comments": 1})
+
+    def test_b_17_get_stats_422(self):
+        response = self.client().get(
+            '/stats?since=2021-03-11T00:00:00&until=2021-03-10T00:00:00')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(data["success"])
 
     def test_c_01_update_category(self):
         response = self.client() \
@@ -206,6 +588,70 @@ class ForumTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertIn('message', data)
 
+    def test_c_02_update_missing_category_404(self):
+        for headers in ({}, {"If-Match": '"1"'}):
+            response = self.client().patch(
+                '/categories/100', json=self.VALID_UPDATE_CATEGORY,
+                headers=headers)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 404)
+            self.assertFalse(data["success"])
+
+    def test_c_03_update_category_if_match(self):
+        response = self.client().patch(
+            '/categories/1', json=self.VALID_UPDATE_CATEGORY,
+            headers={"If-Match": '"1"'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["category"]["version"], 2)
+        self.assertEqual(response.headers["ETag"], '"2"')
+
+    def test_c_04_update_category_409(self):
+        self.client().patch('/categories/1', json=self.VALID_UPDATE_CATEGORY)
+        response = self.client().patch(
+            '/categories/1', json=self.VALID_UPDATE_CATEGORY,
+            headers={"If-Match": '"1"'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(data["success"])
+
+    def test_c_05_update_post(self):
+        response = self.client().get('/posts/1')
+        etag = response.headers["ETag"]
+        update = {"title": "Updated Post"}
+
+        response = self.client().patch(
+            '/posts/1', json=update, headers={"If-Match": etag})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["post"]["title"], update["title"])
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        response = self.client().patch(
+            '/posts/1', json=update, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, 409)
+
+    def test_c_05_update_post_422(self):
+        for body in (["title"], "title", None):
+            response = self.client().patch('/posts/1', json=body)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 422)
+            self.assertFalse(data["success"])
+
+    def test_c_06_update_post_404(self):
+        response = self.client().patch(
+            '/posts/10000', json={"body": "Nothing to update"},
+            headers={"If-Match": '"1"'})
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data["success"])
+
     def test_d_01_delete_comment_on_post(self):
         response = self.client() \
             .delete('/comments', json=self.VALID_DELETE_COMMENT)
@@ -215,6 +661,27 @@ class ForumTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertIn('delete', data)
 
+    def test_d_01_deleted_comment_hides_replies(self):
+        reply = self.create_reply(1)
+        nested = self.create_reply(reply)
+        other = json.loads(self.client().post(
+            '/comments', json=self.VALID_NEW_COMMENT).data)
+        self.client().delete('/comments', json=self.VALID_DELETE_COMMENT)
+
+        data = json.loads(self.client().get('/posts/1').data)
+        self.assertEqual([comment["id"] for comment in data["comments"]],
+                         [other["created_comment_id"]])
+
+        response = self.client().get(
+            '/posts/1/events', headers={'Last-Event-ID': str(reply)},
+            buffered=False)
+        events = iter(response.response)
+        next(events)
+        self.assertTrue(next(events).startswith(
+            'id: {}\n'.format(other["created_comment_id"]).encode()))
+        response.close()
+        self.assertGreater(other["created_comment_id"], nested)
+
     def test_d_02_delete_post(self):
         response = self.client().delete('/posts/1')
         data = json.loads(response.data)
@@ -223,6 +690,26 @@ class ForumTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertIn('delete', data)
 
+        changes = json.loads(self.client().get('/changes').data)["changes"]
+        deleted = [(change["resource"], change["record_id"])
+                   for change in changes if change["operation"] == "delete"]
+        self.assertEqual(deleted, [("comments", 1), ("posts", 1)])
+
+    def test_d_02_comment_on_deleted_post_422(self):
+        self.client().delete('/posts/1')
+        for comment in (self.VALID_NEW_COMMENT,
+                        dict(self.VALID_NEW_COMMENT, parent_id=1),
+                        dict(self.VALID_NEW_COMMENT, durable=True)):
+            response = self.client().post('/comments', json=comment)
+            data = json.loads(response.data)
+
+            self.assertEqual(response.status_code, 422)
+            self.assertFalse(data["success"])
+
+        self.app.config["COMMENT_WRITE_BEHIND"] = True
+        response = self.client().post('/comments', json=self.VALID_NEW_COMMENT)
+        self.assertEqual(response.status_code, 422)
+
     def test_d_03_delete_post_404(self):
         response = self.client().delete('/posts/10000')
         data = json.loads(response.data)
@@ -231,6 +718,106 @@ class ForumTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertIn('message', data)
 
+    def test_d_04_get_deleted_post_404(self):
+        self.client().delete('/posts/1')
+        response = self.client().get('/posts/1')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(data["success"])
+
+    def test_d_05_purge_deleted(self):
+        self.client().delete('/posts/1')
+        comments, posts = purge_deleted(batch_size=1, pause=0)
+        self.assertEqual((comments, posts), (1, 1))
+        self.assertIsNone(Post.query.get(1))
+        self.assertFalse(Comment.query.filter_by(post_id=1).count())
+
+
+class VerifyJWTTestCase(unittest.TestCase):
+    """verify_decode_jwt against local RSA keys instead of Auth0"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.jwks, cls.private_pem = make_keys()
+        cls.rotated_jwks, cls.rotated_pem = make_keys()
+        cls.rotated_jwks['keys'][0]['kid'] = 'rotated'
+
+    def setUp(self):
+        for name, value in (('API_AUDIENCE', 'forum'),
+                            ('_public_keys', {}),
+                            ('_jwks_fetched_at', None)):
+            patcher = mock.patch.object(auth, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        auth.load_jwks(self.jwks)
+
+    def token(self, kid='bench', key=None, algorithm='RS256', **claims):
+        now = int(time.time())
+        payload = {
+            'iss': auth.ISSUER,
+            'aud': auth.API_AUDIENCE,
+            'sub': 'test|1',
+            'iat': now,
+            'exp': now + 3600,
+            'permissions': ['get:posts']
+        }
+        payload.update(claims)
+        return jwt.encode(payload, key or self.private_pem,
+                          algorithm=algorithm, headers={'kid': kid})
+
+    def assertRejected(self, token, code, status_code):
+        with self.assertRaises(auth.AuthError) as raised:
+            auth.verify_decode_jwt(token)
+        self.assertEqual(raised.exception.error['code'], code)
+        self.assertEqual(raised.exception.status_code, status_code)
+
+    def test_valid_token(self):
+        payload = auth.verify_decode_jwt(self.token())
+
+        self.assertEqual(payload['sub'], 'test|1')
+        self.assertEqual(payload['permissions'], ['get:posts'])
+
+    def test_tampered_token(self):
+        header, _, signature = self.token().split('.')
+        forged = jwt.encode({
+            'iss': auth.ISSUER,
+            'aud': auth.API_AUDIENCE,
+            'sub': 'test|1',
+            'exp': int(time.time()) + 3600,
+            'permissions': ['delete:posts']
+        }, 'secret', algorithm='HS256').split('.')[1]
+
+        self.assertRejected('.'.join((header, forged, signature)),
+                            'invalid_header', 400)
+
+    def test_hs256_token(self):
+        self.assertRejected(self.token(key='secret', algorithm='HS256'),
+                            'invalid_header', 400)
+
+    def test_expired_token(self):
+        self.assertRejected(self.token(exp=int(time.time()) - 60),
+                            'token_expired', 401)
+
+    def test_wrong_audience(self):
+        self.assertRejected(self.token(aud='another-api'),
+                            'invalid_claims', 401)
+
+    def test_unknown_kid_refreshes_jwks(self):
+        jwks = {'keys': self.jwks['keys'] + self.rotated_jwks['keys']}
+        with mock.patch.object(auth, 'urlopen', side_effect=lambda url:
+                               io.BytesIO(json.dumps(jwks).encode())) \
+                as urlopen:
+            token = self.token(kid='rotated', key=self.rotated_pem)
+            self.assertEqual(auth.verify_decode_jwt(token)['sub'], 'test|1')
+            self.assertEqual(auth.verify_decode_jwt(token)['sub'], 'test|1')
+            urlopen.assert_called_once_with(auth.JWKS_URL)
+
+            # another unknown kid within the refresh interval
+            self.assertRejected(self.token(kid='unknown'),
+                                'invalid_header', 400)
+            self.assertEqual(urlopen.call_count, 1)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -1,12 +1,8 @@
 import os
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
 
-from app import create_app
-from database.models import (
-    setup_db, db_drop_and_create_all, Post, Comment, Category
-)
+from fixtures import TransactionalTestCase, report_timing
 # Enabling Auth0 if it was disabled before
 # NOTE: Please run these tests in moderation
 # to not get rate-limited by Auth0 servers
@@ -20,17 +16,15 @@ USER_HEADERS = {"Authorization": "Bearer {}".format(USER_TOKEN)}
 ADMIN_HEADERS = {"Authorization": "Bearer {}".format(ADMIN_TOKEN)}
 
 
-class ForumTestCase(unittest.TestCase):
+def tearDownModule():
+    report_timing()
+
+
+class ForumTestCase(TransactionalTestCase):
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.database_name = "forum_test"
-        self.database_path = "postgres://{}/{}" \
-            .format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-        # db_drop_and_create_all()
+        """Define test variables and start the test's transaction."""
+        super().setUp()
 
         self.VALID_NEW_CATEGORY = {
             "name": "RBAC Test Category",
@@ -73,18 +67,6 @@ class ForumTestCase(unittest.TestCase):
             "id": 1
         }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            self.db.drop_all()
-            # create all tables
-            self.db.create_all()
-
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
-
     # ADMIN TESTS
     def test_admin_create_category(self):
         response = self.client() \